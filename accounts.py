@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import weakref
+from collections import OrderedDict
+from dotenv import load_dotenv
+import metrics
+from broker import Broker
+from broker_actor import BrokerActor, BROKER_WORKER
+from journal import Journal
+
+load_dotenv()
+ACCOUNTS_DIR = os.getenv('ACCOUNTS_DIR', 'accounts')
+ACCOUNTS_HOT = int(os.getenv('ACCOUNTS_HOT', '64')) # accounts kept loaded, the least recently used are closed
+ACCOUNTS_PER_GUILD = (os.getenv('ACCOUNTS_PER_GUILD', 'False') == 'True') # separate accounts per server instead of one per user
+STARTING_BALANCE = float(1000000)
+
+
+def account_key(user_id, guild_id=None):
+    """Name of an account, also the file name of its snapshot and journal"""
+    if ACCOUNTS_PER_GUILD and guild_id is not None:
+        return f"{guild_id}-{user_id}"
+    return str(user_id)
+
+
+class AccountStore():
+    """Per-user paper trading accounts. Each account is a Broker with its own snapshot and journal in ACCOUNTS_DIR,
+    behind a BrokerActor. Accounts are loaded on first use (on the broker worker) and kept in an LRU of the
+    ACCOUNTS_HOT most recently used.
+    A summary row per account (cash, holdings, tickers with open orders) is kept in SQLite, so the leaderboard and
+    the order matching see every account without loading them. The worker writes it, the event loop reads it
+    through its own connection (WAL, so reads don't wait on writes)"""
+
+    def __init__(self, api_keys, test_mode=False, directory=ACCOUNTS_DIR, hot=ACCOUNTS_HOT):
+        self.api_keys = api_keys
+        self.test_mode = test_mode
+        self.directory = directory
+        self.hot = hot
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'accounts.sqlite')
+        self._writer = sqlite3.connect(path, check_same_thread=False) # only used on the broker worker
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.execute('CREATE TABLE IF NOT EXISTS accounts (key TEXT PRIMARY KEY, user_id INTEGER NOT NULL, guild_id INTEGER, '
+                             'balance REAL NOT NULL, holdings TEXT NOT NULL, pending TEXT NOT NULL, updated REAL NOT NULL)')
+        self._writer.commit()
+        self._db = sqlite3.connect(path)
+        self._accounts = OrderedDict() # key -> BrokerActor, least recently used first
+        self._evicted = weakref.WeakValueDictionary() # key -> evicted BrokerActor still referenced by a running command
+        self._loading = {} # key -> task, so an account is loaded once at a time
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM accounts').fetchone()[0]
+
+    async def get(self, user_id, guild_id=None):
+        """The account of a Discord user (in a guild, with ACCOUNTS_PER_GUILD), loaded or created on first use"""
+        if not ACCOUNTS_PER_GUILD:
+            guild_id = None
+        key = account_key(user_id, guild_id)
+        account = self._hot_account(key)
+        if account is not None:
+            return account
+        return await self._load(key, user_id, guild_id)
+
+    async def by_key(self, key):
+        """A stored account by its key, None if there is no such account"""
+        account = self._hot_account(key)
+        if account is not None:
+            return account
+        row = self._db.execute('SELECT user_id, guild_id FROM accounts WHERE key = ?', (key,)).fetchone()
+        return None if row is None else await self._load(key, *row)
+
+    def _hot_account(self, key):
+        """The loaded actor for key, None if it has to be loaded. An evicted actor that is still in use is taken back
+        rather than opening a second Broker (and a second writer) on the same files"""
+        account = self._accounts.get(key)
+        if account is not None:
+            self._accounts.move_to_end(key)
+            return account
+        account = self._evicted.pop(key, None)
+        if account is not None:
+            self._keep(key, account)
+        return account
+
+    def _keep(self, key, account):
+        self._accounts[key] = account
+        while len(self._accounts) > self.hot:
+            evicted_key, evicted = self._accounts.popitem(last=False)
+            self._evicted[evicted_key] = evicted
+            evicted.close() # the journal reopens if a command still running on it writes again
+        metrics.gauge('accounts_hot', len(self._accounts))
+
+    async def _load(self, key, user_id, guild_id):
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = asyncio.ensure_future(self._open_async(key, user_id, guild_id))
+            task.add_done_callback(lambda task: self._loading.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _open_async(self, key, user_id, guild_id):
+        loop = asyncio.get_running_loop()
+        with metrics.timer('account_load_seconds'):
+            account = BrokerActor(await loop.run_in_executor(BROKER_WORKER, self._open, key, user_id, guild_id))
+        self._keep(key, account)
+        metrics.count('account_loads')
+        return account
+
+    def _open(self, key, user_id, guild_id):
+        """Loads (or creates) an account's Broker, on the broker worker"""
+        path = os.path.join(self.directory, key)
+        broker = Broker(self.api_keys, test_mode=self.test_mode, starting_amount=STARTING_BALANCE, journal=Journal(path + '.pickle', path + '.journal'), account=key)
+        broker.on_change = lambda: self._save_summary(key, user_id, guild_id, broker)
+        self._writer.execute('INSERT OR IGNORE INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, user_id, guild_id, broker.balance, json.dumps(broker.owned_shares), json.dumps(broker.pending_tickers()), time.time()))
+        self._writer.commit()
+        return broker
+
+    def _save_summary(self, key, user_id, guild_id, broker):
+        self._writer.execute('INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, user_id, guild_id, broker.balance, json.dumps(broker.owned_shares), json.dumps(broker.pending_tickers()), time.time()))
+        self._writer.commit()
+
+    def pending(self):
+        """(key, user_id, tickers) of every account with queued or resting orders"""
+        rows = self._db.execute("SELECT key, user_id, pending FROM accounts WHERE pending != '[]'")
+        return [(key, user_id, json.loads(pending)) for key, user_id, pending in rows]
+
+    def holders(self):
+        """(key, holdings) of every account holding shares"""
+        rows = self._db.execute("SELECT key, holdings FROM accounts WHERE holdings != '{}'")
+        return [(key, json.loads(holdings)) for key, holdings in rows]
+
+    def summaries(self, guild_id=None):
+        """(user_id, cash balance, holdings) of every account (in guild_id, with ACCOUNTS_PER_GUILD)"""
+        if ACCOUNTS_PER_GUILD and guild_id is not None:
+            rows = self._db.execute('SELECT user_id, balance, holdings FROM accounts WHERE guild_id = ?', (guild_id,))
+        else:
+            rows = self._db.execute('SELECT user_id, balance, holdings FROM accounts')
+        return [(user_id, balance, json.loads(holdings)) for user_id, balance, holdings in rows]
+
+    def leaderboard(self, summaries, prices):
+        """(user_id, total value, cash balance) for summaries, highest value first. Holdings without a price count as 0"""
+        ranking = [(user_id, balance + sum(shares * prices.get(ticker, 0) for ticker, shares in holdings.items()), balance)
+                   for user_id, balance, holdings in summaries]
+        return sorted(ranking, key=lambda row: row[1], reverse=True)
+
+    def stats(self):
+        return f"{len(self._accounts)} loaded of {len(self)}"
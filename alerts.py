@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import time
+from dotenv import load_dotenv
+import metrics
+from threshold_index import ThresholdIndex
+
+load_dotenv()
+ALERTS_DB = os.getenv('ALERTS_DB', 'alerts.sqlite')
+ALERT_KINDS = ('above', 'below', 'pct-move')
+
+
+class Alert():
+
+    def __init__(self, alert_id, symbol, kind, value, reference, channel_id, user_id, created):
+        self.id = alert_id
+        self.symbol = symbol
+        self.kind = kind
+        self.value = value # price for above/below, percent for pct-move
+        self.reference = reference # price when the alert was set
+        self.channel_id = channel_id
+        self.user_id = user_id
+        self.created = created
+
+    def thresholds(self):
+        """(above, below) prices that fire this alert, None for a side it doesn't watch"""
+        if self.kind == 'above':
+            return self.value, None
+        if self.kind == 'below':
+            return None, self.value
+        return self.reference * (1 + self.value / 100), self.reference * (1 - self.value / 100)
+
+    def describe(self):
+        if self.kind == 'pct-move':
+            return f"#{self.id} {self.symbol} moves {self.value:g}% from ${self.reference:,.2f}"
+        return f"#{self.id} {self.symbol} {self.kind} ${self.value:,.2f}"
+
+
+class AlertBook():
+    """Price alerts in a ThresholdIndex, so checking a price finds the crossed alerts by bisection.
+    pct-move alerts are indexed as an above and a below threshold around the reference price.
+    Alerts fire once and are stored in SQLite"""
+
+    def __init__(self, path=ALERTS_DB):
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS alerts (id INTEGER PRIMARY KEY AUTOINCREMENT, symbol TEXT NOT NULL, kind TEXT NOT NULL, '
+                         'value REAL NOT NULL, reference REAL NOT NULL, channel_id INTEGER NOT NULL, user_id INTEGER, created REAL NOT NULL)')
+        self._db.commit()
+        self.alerts = {} # id -> Alert
+        self._index = ThresholdIndex()
+        for row in self._db.execute('SELECT * FROM alerts'):
+            self._track(Alert(*row))
+
+    def _track(self, alert):
+        self.alerts[alert.id] = alert
+        self._index.add(alert.symbol, alert.id, *alert.thresholds())
+
+    def _untrack(self, alert):
+        del self.alerts[alert.id]
+        self._index.remove(alert.symbol, alert.id, *alert.thresholds())
+
+    def add(self, symbol, kind, value, reference, channel_id, user_id=None):
+        """Stores a new alert, returns it"""
+        if kind not in ALERT_KINDS:
+            raise ValueError(f"Unknown alert type {kind}")
+        created = time.time()
+        cursor = self._db.execute('INSERT INTO alerts (symbol, kind, value, reference, channel_id, user_id, created) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  (symbol, kind, value, reference, channel_id, user_id, created))
+        self._db.commit()
+        alert = Alert(cursor.lastrowid, symbol, kind, value, reference, channel_id, user_id, created)
+        self._track(alert)
+        metrics.gauge('alerts', len(self.alerts))
+        return alert
+
+    def remove(self, alert_id):
+        """Removes an alert, returns it (None if there is no such alert)"""
+        alert = self.alerts.get(alert_id)
+        if alert is None:
+            return None
+        self._untrack(alert)
+        self._db.execute('DELETE FROM alerts WHERE id = ?', (alert_id,))
+        self._db.commit()
+        metrics.gauge('alerts', len(self.alerts))
+        return alert
+
+    def symbols(self):
+        """Every symbol with an alert on it"""
+        return self._index.symbols()
+
+    def for_channel(self, channel_id):
+        return [alert for alert in self.alerts.values() if alert.channel_id == channel_id]
+
+    def check(self, prices):
+        """Fires (and removes) every alert crossed by prices, a dict of symbol -> price. Returns [(alert, price)]"""
+        fired = []
+        for symbol, price in prices.items():
+            for alert_id in self._index.crossed(symbol, price):
+                alert = self.alerts[alert_id]
+                self._untrack(alert)
+                fired.append((alert, price))
+        if fired:
+            self._db.executemany('DELETE FROM alerts WHERE id = ?', [(alert.id,) for alert, price in fired])
+            self._db.commit()
+            metrics.count('alerts_fired', len(fired))
+            metrics.gauge('alerts', len(self.alerts))
+        return fired
+
+
+ALERTS = AlertBook()
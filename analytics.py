@@ -0,0 +1,68 @@
+import os
+from datetime import date
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+RISK_FREE_RATE = float(os.getenv('RISK_FREE_RATE', '0.0')) # annual, for Sharpe and Sortino
+TRADING_DAYS = 252
+
+_memo = {} # (account, time_span) -> (history version, today, stats)
+
+
+def return_stats(closes, risk_free_rate=RISK_FREE_RATE):
+    """Return and risk statistics of a series of daily closing values, None with fewer than two closes"""
+    closes = np.asarray(closes, dtype='f8')
+    if len(closes) < 2:
+        return None
+    returns = closes[1:] / closes[:-1] - 1
+    excess = returns - risk_free_rate / TRADING_DAYS
+    std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+    downside = np.sqrt(np.mean(np.minimum(excess, 0) ** 2))
+    drawdowns = closes / np.maximum.accumulate(closes) - 1
+    trough = int(drawdowns.argmin())
+    return {
+        'days' : len(returns),
+        'cumulative_return' : closes[-1] / closes[0] - 1,
+        'mean_daily_return' : returns.mean(),
+        'best_day' : returns.max(),
+        'worst_day' : returns.min(),
+        'volatility' : std * np.sqrt(TRADING_DAYS),
+        'max_drawdown' : drawdowns[trough],
+        'max_drawdown_peak' : int(closes[:trough + 1].argmax()),
+        'max_drawdown_trough' : trough,
+        'sharpe' : excess.mean() / std * np.sqrt(TRADING_DAYS) if std else None,
+        'sortino' : excess.mean() / downside * np.sqrt(TRADING_DAYS) if downside else None
+    }
+
+def history_stats(history, time_span='F', today=None, account=None):
+    """return_stats over a PortfolioHistory window, memoized per account until the history changes (or the day does).
+    Views of an account's history are new objects with the same version, so the memo is keyed by account"""
+    day = today or date.today()
+    memo = _memo.get((account, time_span))
+    if memo is not None and memo[0] == history.version and memo[1] == day:
+        return memo[2]
+    bars = history.window(time_span, today)
+    stats = return_stats(bars['close'])
+    if stats is not None:
+        stats['start_date'] = int(bars['date'][0])
+        stats['peak_date'] = int(bars['date'][stats['max_drawdown_peak']])
+        stats['trough_date'] = int(bars['date'][stats['max_drawdown_trough']])
+    _memo[(account, time_span)] = (history.version, day, stats)
+    return stats
+
+def contributions(owned_shares, cost_basis, prices, total):
+    """Per position (ticker, market value, weight, unrealized P/L, contribution), biggest value first.
+    Weight and contribution (unrealized P/L) are fractions of the total portfolio value"""
+    if not owned_shares:
+        return []
+    tickers = [ticker for ticker in owned_shares if ticker in prices]
+    shares = np.array([owned_shares[ticker] for ticker in tickers], dtype='f8')
+    price = np.array([prices[ticker] for ticker in tickers], dtype='f8')
+    cost = np.array([cost_basis[ticker] for ticker in tickers], dtype='f8')
+    value = shares * price
+    pnl = shares * (price - cost)
+    weight = value / total if total else np.zeros_like(value)
+    contribution = pnl / total if total else np.zeros_like(pnl)
+    order = np.argsort(-value)
+    return [(tickers[i], value[i], weight[i], pnl[i], contribution[i]) for i in order]
@@ -0,0 +1,149 @@
+"""Backtests against the daily bars in HISTORY_STORE. Nothing here makes upstream requests, callers load the
+history they need first (HISTORY_STORE.get_async) and pass the bars in.
+
+Two kinds of runs:
+    replay_orders   dated buy/sell orders, filled at the close with the same checks as Broker (broker.buy_error/sell_error)
+    run_strategy    a rule applied to every ticker, vectorized over dates and tickers. Strategy specs are strings:
+                    'hold', 'sma:FAST:SLOW' (in while the fast moving average is above the slow one),
+                    'momentum:DAYS' (in while the close is above the close DAYS trading days earlier)
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import numpy as np
+from dotenv import load_dotenv
+from analytics import return_stats
+from broker import buy_error, sell_error
+
+load_dotenv()
+BACKTEST_WORKERS = int(os.getenv('BACKTEST_WORKERS', '2'))
+BACKTEST_CASH = float(1000000) # same as a new Broker
+DEFAULT_STRATEGIES = ('hold', 'sma:20:50', 'sma:50:200', 'momentum:60')
+
+_pool = None
+
+
+def align(bars_by_ticker):
+    """(dates, closes) for a dict of ticker -> bars: the union of their trading days, and a (days x tickers) close
+    matrix in dict order, carried forward over gaps and NaN before a ticker's first bar"""
+    dates = np.unique(np.concatenate([bars['date'] for bars in bars_by_ticker.values()]))
+    closes = np.full((len(dates), len(bars_by_ticker)), np.nan)
+    for j, bars in enumerate(bars_by_ticker.values()):
+        closes[np.searchsorted(dates, bars['date']), j] = bars['close']
+    # forward fill: index of the last row with a price, per column
+    rows = np.where(np.isnan(closes), 0, np.arange(len(dates))[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return dates, closes[rows, np.arange(closes.shape[1])]
+
+def parse_strategy(spec):
+    """('hold' | 'sma' | 'momentum', int params) from a spec string, ValueError if it isn't one"""
+    kind, *params = spec.lower().split(':')
+    params = tuple(int(param) for param in params)
+    if (kind, len(params)) not in (('hold', 0), ('sma', 2), ('momentum', 1)) or any(param <= 0 for param in params):
+        raise ValueError(f"Unknown strategy {spec}")
+    if kind == 'sma' and params[0] >= params[1]:
+        raise ValueError(f"Fast average must be shorter than the slow one in {spec}")
+    return kind, params
+
+def moving_average(closes, window):
+    """Trailing mean over window rows per column, NaN where the window has a NaN (before a ticker's first bar)"""
+    start = np.zeros((1, closes.shape[1]))
+    sums = np.vstack([start, np.nancumsum(closes, axis=0)])
+    counts = np.vstack([start, np.cumsum(~np.isnan(closes), axis=0)])
+    averages = np.full_like(closes, np.nan)
+    full = counts[window:] - counts[:-window] == window
+    averages[window - 1:] = np.where(full, (sums[window:] - sums[:-window]) / window, np.nan)
+    return averages
+
+def signals(spec, closes):
+    """Boolean (days x tickers), True where the strategy wants to hold the ticker at that day's close"""
+    kind, params = parse_strategy(spec)
+    if kind == 'hold':
+        return ~np.isnan(closes)
+    if kind == 'sma':
+        if len(closes) < params[1]:
+            return np.zeros(closes.shape, dtype=bool)
+        with np.errstate(invalid='ignore'):
+            return moving_average(closes, params[0]) > moving_average(closes, params[1])
+    lookback = params[0]
+    held = np.zeros(closes.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        held[lookback:] = closes[lookback:] > closes[:-lookback]
+    return held
+
+def run_strategy(spec, dates, closes, cash=BACKTEST_CASH):
+    """Equity curve of spec, with cash split evenly across the tickers and each slice fully in or out.
+    Positions change at the close, so a signal earns the next day's return"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.nan_to_num(closes[1:] / closes[:-1] - 1)
+    held = signals(spec, closes)[:-1]
+    slices = np.vstack([np.ones(closes.shape[1]), np.cumprod(1 + held * returns, axis=0)])
+    return slices.sum(axis=1) * cash / closes.shape[1]
+
+def replay_orders(orders, dates, closes, tickers, cash=BACKTEST_CASH):
+    """Fills orders, a list of (date, ticker, shares) with negative shares for sells, at the close of the first
+    trading day on or after each date. Returns (equity curve, list of messages)"""
+    column = { ticker : j for j, ticker in enumerate(tickers) }
+    start_cash = cash
+    shares_bought = np.zeros(closes.shape)
+    cash_spent = np.zeros(len(dates))
+    owned = {}
+    messages = []
+    for d, ticker, shares in sorted(orders, key=lambda order: order[0]):
+        i = np.searchsorted(dates, d.toordinal())
+        j = column.get(ticker)
+        if j is None or i == len(dates) or np.isnan(closes[i, j]):
+            messages.append(f'No price found for {ticker} on {d}, skipping.')
+            continue
+        day, price = date.fromordinal(int(dates[i])), closes[i, j]
+        if shares > 0:
+            error = buy_error(ticker, shares, price, cash)
+        else:
+            error = sell_error(ticker, -shares, owned.get(ticker, 0))
+        if error:
+            messages.append(f'{day}: {error}')
+            continue
+        cash -= shares * price
+        owned[ticker] = owned.get(ticker, 0) + shares
+        if shares > 0:
+            messages.append(f'{day}: bought {shares} shares of {ticker} at price ${price:.2f} for a total of ${shares * price:.2f}.')
+        else:
+            messages.append(f'{day}: sold {-shares} shares of {ticker} at price ${price:.2f} for a total of ${-shares * price:.2f}.')
+        shares_bought[i, j] += shares
+        cash_spent[i] += shares * price
+
+    positions = np.cumsum(shares_bought, axis=0)
+    balance = start_cash - np.cumsum(cash_spent)
+    return balance + (positions * np.nan_to_num(closes)).sum(axis=1), messages
+
+def summarize(name, dates, equity):
+    """Result dict: name, dates, equity curve and analytics.return_stats of it"""
+    stats = return_stats(equity)
+    return { 'name' : name, 'dates' : dates, 'equity' : equity, 'final' : float(equity[-1]), 'stats' : stats }
+
+def _strategy_job(spec, dates, closes, cash):
+    return summarize(spec, dates, run_strategy(spec, dates, closes, cash))
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=BACKTEST_WORKERS)
+    return _pool
+
+async def run_strategies_async(specs, bars_by_ticker, cash=BACKTEST_CASH):
+    """Results of every strategy spec over the same tickers, spread over the backtest process pool so the event
+    loop doesn't wait on the math"""
+    for spec in specs:
+        parse_strategy(spec) # fail fast on a bad spec
+    dates, closes = align(bars_by_ticker)
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(loop.run_in_executor(get_pool(), _strategy_job, spec, dates, closes, cash) for spec in specs))
+
+def chart_args(result):
+    """Arguments for render.render_candlestick, one candle per day from the previous day's equity to this one's"""
+    equity = result['equity']
+    opens = np.concatenate([equity[:1], equity[:-1]])
+    dates = [date.fromordinal(int(d)).isoformat() for d in result['dates']]
+    return (f"Backtest: {result['name']}", "Equity", dates, opens.tolist(), np.maximum(opens, equity).tolist(),
+            np.minimum(opens, equity).tolist(), equity.tolist())
@@ -0,0 +1,232 @@
+"""End to end latency benchmarks for the bot's commands, run against fake_upstream with fake Discord objects.
+No API keys or Discord connection needed.
+
+    python bench.py --iterations 20 --sizes 1 10 40 --latency 0.05
+
+For each command this reports p50/p99 latency and upstream requests per command, cold (quote and chart
+caches cleared before each run) and warm.
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+from itertools import product
+from fake_upstream import FakeUpstream
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+STONKS_CHANNEL_ID = 1234
+
+
+class FakeUser():
+
+    def __init__(self, name='bench'):
+        self.name = name
+        self.id = hash(name)
+        self.edits = 0
+
+    async def edit(self, **kwargs):
+        self.edits += 1
+
+
+class FakeTyping():
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeChannel():
+
+    def __init__(self, channel_id=STONKS_CHANNEL_ID, name='stonks'):
+        self.id = channel_id
+        self.name = name
+        self.sent = [] # (content, file) in order
+        self.edits = 0
+
+    async def send(self, content=None, file=None, files=None, **kwargs):
+        self.sent.append((content, file or files))
+        return FakeMessage(content or '', self)
+
+    def typing(self):
+        return FakeTyping()
+
+    async def edit(self, name=None, **kwargs):
+        self.edits += 1
+        if name is not None:
+            self.name = name
+
+
+class FakeMessage():
+
+    def __init__(self, content, channel, author=None):
+        self.content = content
+        self.channel = channel
+        self.author = author or FakeUser()
+        self.guild = None
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+
+def symbols(n):
+    """n distinct made up ticker symbols"""
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXY'
+    names = []
+    for a, b, c in product(letters, repeat=3):
+        if len(names) == n:
+            break
+        names.append(a + b + c)
+    return names
+
+
+class Harness():
+    """Loads stonks-bot.py in a scratch directory against a FakeUpstream, and drives its handlers"""
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.channel = FakeChannel()
+        self.bot = None
+        self.workdir = None
+
+    async def start(self):
+        await self.upstream.start()
+        self.workdir = tempfile.mkdtemp(prefix='stonks-bench-')
+        shutil.copytree(os.path.join(REPO, 'pfp'), os.path.join(self.workdir, 'pfp'))
+        os.chdir(self.workdir)
+
+        env = {
+            'DISCORD_TOKEN' : 'bench', 'FINNHUB_KEY' : 'bench', 'ALPHAVANTAGE_KEY' : 'bench',
+            'FINANCIALMODELING_KEYS' : 'bench1,bench2', 'STONKS_EMOJI' : '1', 'UNSTONKS_EMOJI' : '2',
+            'STATUS_TICKER' : 'PORTFOLIO', 'STATUS_UPDATE_SECS' : '60', 'STONKS_CHANNEL' : str(STONKS_CHANNEL_ID),
+            'INFO_WIDTH' : '100', 'TEST_MODE' : 'False',
+            'FINANCIALMODELING_PER_MINUTE' : '1000000', 'FINANCIALMODELING_PER_DAY' : '1000000',
+            'FINNHUB_PER_MINUTE' : '1000000', 'ALPHAVANTAGE_PER_MINUTE' : '1000000', 'ALPHAVANTAGE_PER_DAY' : '1000000'
+        }
+        env.update(self.upstream.urls())
+        os.environ.update(env)
+
+        spec = importlib.util.spec_from_file_location('stonks_bot', os.path.join(REPO, 'stonks-bot.py'))
+        self.bot = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.bot)
+        self.bot.setup()
+
+        client = self.bot.client
+        client._connection.user = FakeUser('stonks-bot')
+        client.is_ready = lambda: True
+        client.get_channel = lambda channel_id: self.channel
+        async def change_presence(**kwargs):
+            pass
+        client.change_presence = change_presence
+
+    async def stop(self):
+        import http_client
+        await http_client.close()
+        await self.upstream.stop()
+        os.chdir(REPO)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def set_market_open(self, market_open):
+        """Overrides the exchange calendar so results don't depend on when the benchmark runs"""
+        self.upstream.market_open = market_open
+        self.bot.MARKET_CALENDAR.is_open = lambda now=None: market_open
+
+    async def set_portfolio(self, n_positions):
+        from portfolio_history import PortfolioHistory
+        from order_book import OrderBook
+        def reset(broker):
+            broker.balance = 1000000.0
+            broker.owned_shares = { symbol : 10 for symbol in symbols(n_positions) }
+            broker.cost_basis = { symbol : 100.0 for symbol in broker.owned_shares }
+            broker.portfolio_history = PortfolioHistory.from_dict({ '01/01/2000' : { 'open' : 1e6, 'high' : 1e6, 'low' : 1e6, 'close' : 1e6 } })
+            broker.order_queue.clear()
+            broker.resting_orders = OrderBook()
+        account = await self.bot.accounts.get(FakeUser().id)
+        self.bot.status_account_key = account.account
+        await account.submit(reset, account.broker)
+
+    def clear_caches(self):
+        from quote_cache import QUOTE_CACHE
+        from chart_cache import CHART_CACHE
+        from market import MARKET
+        QUOTE_CACHE.invalidate()
+        CHART_CACHE.clear()
+        MARKET.invalidate()
+
+    async def command(self, text):
+        """Runs one message through on_message, returns what the bot sent"""
+        start = len(self.channel.sent)
+        await self.bot.on_message(FakeMessage(text, self.channel))
+        return self.channel.sent[start:]
+
+    async def tick(self):
+        await self.bot.ticker_status()
+
+
+async def measure(harness, run, iterations, cold):
+    """Returns (sorted latencies in seconds, upstream requests per run)"""
+    latencies = []
+    calls_before = sum(harness.upstream.calls.values())
+    for i in range(iterations):
+        if cold:
+            harness.clear_caches()
+        start = time.perf_counter()
+        await run()
+        latencies.append(time.perf_counter() - start)
+    calls = sum(harness.upstream.calls.values()) - calls_before
+    return sorted(latencies), calls / iterations
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+async def main(args):
+    upstream = FakeUpstream(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+    harness = Harness(upstream)
+    await harness.start()
+    harness.set_market_open(True)
+
+    scenarios = [
+        ('stonks TICKER', None, lambda: harness.command('stonks AAPL')),
+        ('stonks 10 TICKERS', None, lambda: harness.command('stonks ' + ' '.join(symbols(10)))),
+        ('stonks info 5', None, lambda: harness.command('stonks info ' + ' '.join(symbols(5)))),
+        ('stonks chart', None, lambda: harness.command('stonks chart SPY M')),
+        ('stonks market', None, lambda: harness.command('stonks market')),
+        ('stonks buy', None, lambda: harness.command('stonks buy AAPL 1')),
+        ('stonks sell', None, lambda: harness.command('stonks sell AAPL 1')),
+    ]
+    for size in args.sizes:
+        scenarios.append(('stonks portfolio', size, lambda: harness.command('stonks portfolio')))
+        scenarios.append(('ticker_status tick', size, harness.tick))
+
+    print(f"{'command':<20}{'positions':>10}{'mode':>6}{'p50 ms':>10}{'p99 ms':>10}{'calls/op':>10}")
+    try:
+        for name, size, run in scenarios:
+            for cold in (True, False):
+                await harness.set_portfolio(size or 0)
+                try:
+                    latencies, calls = await measure(harness, run, args.iterations, cold)
+                except Exception as e:
+                    print(f"{name:<20}{size or '':>10}{'cold' if cold else 'warm':>6}  failed: {e!r}")
+                    continue
+                print(f"{name:<20}{size or '':>10}{'cold' if cold else 'warm':>6}"
+                      f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 99) * 1000:>10.1f}{calls:>10.2f}")
+    finally:
+        await harness.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark stonks-bot commands against a fake upstream')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 40], help='portfolio sizes for portfolio and status tick runs')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every upstream request')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    asyncio.run(main(parser.parse_args()))
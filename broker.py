@@ -1,262 +1,468 @@
-import requests
+import asyncio
 import json
 import os
-from datetime import date, datetime, timedelta
+import time
+from datetime import date, datetime
 from collections import deque
-import plotly.graph_objs as go
-import pickle
-
-def save(func):
-    def wrapper(*args, **kwargs):
-        rval = func(*args, **kwargs)
-        self = args[0]
-        self.pickle_data()
-        return rval
-    return wrapper
+import render
+from chart_cache import CHART_CACHE, chart_key
+from journal import Journal
+from key_scheduler import get_scheduler
+from market_calendar import MARKET_CALENDAR
+from order_book import OrderBook, RestingOrder
+from portfolio_history import PortfolioHistory
+from quote_cache import QUOTE_CACHE
+from http_client import FINANCIALMODELING_URL
+from dotenv import load_dotenv
+
+load_dotenv()
+QUOTE_URL = FINANCIALMODELING_URL + 'quote/'
+MARKET_OPEN_URL = FINANCIALMODELING_URL + 'is-the-market-open'
+QUOTE_BATCH_SIZE = 50 # symbols per multi-symbol quote request
+MARKET_CALENDAR_RECONCILE = (os.getenv('MARKET_CALENDAR_RECONCILE', 'True') == 'True')
+
+def queue_tickers(orders):
+    """Every ticker in a list of queued orders, in first-seen order"""
+    return list(dict.fromkeys(ticker for order_id, order_type, order in orders for ticker in order))
+
+def buy_error(ticker, shares, price, balance, note=''):
+    """Why buying shares of ticker at price can't be done with balance, None if it can"""
+    cost = shares * price
+    if cost >= balance:
+        return f'Cannot afford {shares} shares of {ticker}{note} for total cost of ${cost:.2f}. Current balance: ${balance:.2f}'
+    return None
+
+def sell_error(ticker, shares, owned, note=''):
+    """Why selling shares of ticker can't be done owning owned shares, None if it can"""
+    if not owned:
+        return f'You do not own {ticker}.'
+    if shares > owned:
+        return f'You have {owned} shares of {ticker} but tried to sell {shares} shares{note}.'
+    return None
+
+def describe_queued(entry):
+    """One line for a queued (id, type, order) entry"""
+    order_id, order_type, order = entry
+    return f"#{order_id} {order_type} " + ', '.join(f"{shares} {ticker}" for ticker, shares in order.items())
 
 class Broker():
 
-    def __init__(self, FINANCIAL_MODELING_API_KEYS, test_mode=False, starting_amount = float(1000000), pickle_file = 'broker_data.pickle'):
-        """Takes list of api keys to use and starting amount"""
+    def __init__(self, FINANCIAL_MODELING_API_KEYS, test_mode=False, starting_amount = float(1000000), pickle_file = 'broker_data.pickle', journal=None, account=None):
+        """Takes list of api keys to use and starting amount. journal defaults to broker.pickle/broker.journal,
+        account names the account (None for the shared one) in chart cache keys"""
 
         self.TEST_MODE = test_mode
+        self.account = account
+        self.on_change = None # called after every journal write, set by AccountStore
 
         self.balance = starting_amount
         self.owned_shares = {}
         self.cost_basis = {}
-        self.portfolio_history = {}
-        self.order_queue = deque()
-        
-        # updates data from pickle
-        self.load_data()
+        self.portfolio_history = PortfolioHistory()
+        self.order_queue = deque() # (order id, 'BUY' | 'SELL', {ticker : shares}) waiting for the market to open
+        self.resting_orders = OrderBook() # limit and stop orders waiting for their trigger price
+        self.next_order_id = 1 # shared by queued and resting orders
 
-        self._curr_key_idx = 0
+        # updates data from snapshot + journal
+        self._journal = journal or Journal()
+        self.load_data()
 
         if isinstance(FINANCIAL_MODELING_API_KEYS, str):
             self.FINANCIAL_MODELING_API_KEYS = [FINANCIAL_MODELING_API_KEYS]
         else:
             self.FINANCIAL_MODELING_API_KEYS = list(FINANCIAL_MODELING_API_KEYS)
+        self.key_scheduler = get_scheduler('fmp', self.FINANCIAL_MODELING_API_KEYS)
 
 
-    def get_curr_prices(self, tickers):
+    async def get_curr_prices_async(self, tickers):
         """Takes iterable of UPPERCASE ticker symbols, then returns dictionary of prices corresponding to those tickers"""
+        prices, missing = await self.get_curr_prices_and_missing_async(tickers)
+        return prices
+
+    async def get_curr_prices_and_missing_async(self, tickers):
+        """Like get_curr_prices_async, but also returns a list of the tickers that no price was found for.
+        Quotes are fetched QUOTE_BATCH_SIZE symbols per request, and only symbols dropped from a batch are retried one at a time"""
+        tickers = list(dict.fromkeys(tickers))
 
         if not tickers:
             raise Exception('Empty list of tickers given')
 
-        prices = {}
+        cached = await QUOTE_CACHE.get_many_async([('fmp', ticker) for ticker in tickers], self._fetch_cached_prices_async)
+        prices = { key[1] : price for key, price in cached.items() }
 
-        for ticker in tickers:
-            params = { 'apikey' : self.get_curr_key() }
-            response = self.make_request('https://financialmodelingprep.com/api/v3/quote/' + ticker, params)
+        missing = [ticker for ticker in tickers if ticker not in prices]
+        return prices, missing
 
-            if response.status_code != 200:
-                raise Exception(f"Bad response code, response code {response.status_code}")
+    async def _fetch_cached_prices_async(self, keys):
+        """fetch_many callback for QUOTE_CACHE, keys are ('fmp', ticker)"""
+        prices = await self.fetch_prices_async([key[1] for key in keys])
+        return { ('fmp', ticker) : price for ticker, price in prices.items() }
 
-            data = response.json()
+    async def fetch_prices_async(self, tickers):
+        """Fetches prices for a list of tickers, bypassing the cache. Batches are requested concurrently"""
+        prices = {}
 
-            if 'Error Message' in data:
-                raise Exception('Unable to get ticker info from https://financialmodelingprep.com/api/v3/quote/')
+        batches = [tickers[i:i + QUOTE_BATCH_SIZE] for i in range(0, len(tickers), QUOTE_BATCH_SIZE)]
+        for result in await asyncio.gather(*(self.fetch_quotes_async(batch) for batch in batches)):
+            prices.update(result)
 
-            for stock in data: # 0 or 1 iterations
-                prices[stock['symbol']] = stock['price']
+        dropped = [ticker for ticker in tickers if ticker not in prices]
+        for result in await asyncio.gather(*(self.fetch_quotes_async([ticker]) for ticker in dropped)):
+            prices.update(result)
 
         return prices
 
-    def make_request(self, url, params):
-        '''Makes request, tries until success (unless no keys work), params should not include apikey, although it won't matter too much'''
-        for try_num in range(len(self.FINANCIAL_MODELING_API_KEYS)):
-            params['apikey'] = self.get_curr_key()
-            response = requests.get(url, params)
-            if response.status_code == 200:
-                return response
-        raise Exception(f'Attempted to make request to URL {url} but there are no api keys with uses left.')
-
-    @save
-    def execute_queue_orders(self):
-        if self.market_is_open():
-            while self.order_queue:
-                order_type, order = self.order_queue.popleft()
-                if order_type == 'BUY':
-                    self.buy_stocks(order)
-                else:
-                    self.sell_stocks(order)
+    async def fetch_quotes_async(self, tickers):
+        """Makes a single quote request for a list of tickers, returns dictionary of prices for the symbols that came back"""
+        response = await self.make_request_async(QUOTE_URL + ','.join(tickers), {})
 
-    def get_curr_key(self):
-        """Cycles through API keys"""
-        self._curr_key_idx = (self._curr_key_idx + 1) % len(self.FINANCIAL_MODELING_API_KEYS)
-        return self.FINANCIAL_MODELING_API_KEYS[self._curr_key_idx]
+        data = response.json()
 
-    @save
-    def buy_stocks(self, buy_order):
-        """Takes dictionary buy_order, mapping from ticker symbol to number of shares to buy, then buys one at a time"""
+        if 'Error Message' in data:
+            raise Exception('Unable to get ticker info from ' + QUOTE_URL)
+
+        return { stock['symbol'] : stock['price'] for stock in data }
+
+    async def make_request_async(self, url, params):
+        '''Makes request with the key that has the most quota left, moving on to other keys if one is throttled'''
+        return await self.key_scheduler.get_async(url, params)
+
+    def fill_queue_orders(self, orders, prices, missing):
+        """Fills orders (the front of the order queue) at one set of prices with a single journal write.
+        Orders are checked in queue order as if filled one at a time (so an order that couldn't be filled on its own
+        is skipped), then the ones that pass are netted into one trade per ticker, sells first so they free up cash
+        for the buys. The end state is the same as filling them one at a time"""
+        for i in range(len(orders)):
+            self.order_queue.popleft()
+        deltas = [('queue_pop', len(orders))]
+
+        report = [f'Executed {len(orders)} queued orders:']
+        for ticker in missing:
+            report.append(f'No price found for {ticker}, skipping.')
+
+        balance = self.balance
+        owned = dict(self.owned_shares)
+        net = {}
+        counts = {}
+        for order_id, order_type, order in orders:
+            for ticker, shares in order.items():
+                if ticker not in prices:
+                    continue
+                if order_type == 'BUY':
+                    error = buy_error(ticker, shares, prices[ticker], balance)
+                else:
+                    error = sell_error(ticker, shares, owned.get(ticker, 0))
+                    shares = -shares
+                if error:
+                    report.append(f'#{order_id}: {error}')
+                    continue
+                balance -= shares * prices[ticker]
+                owned[ticker] = owned.get(ticker, 0) + shares
+                net[ticker] = net.get(ticker, 0) + shares
+                counts[ticker] = counts.get(ticker, 0) + 1
+
+        for ticker in sorted(net, key=lambda ticker: net[ticker]):
+            shares = net[ticker]
+            note = f' (net of {counts[ticker]} orders)' if counts[ticker] > 1 else ''
+            if shares == 0:
+                report.append(f'Buys and sells of {ticker}{note} cancel out.')
+                continue
+            filled, message = self.trade('BUY' if shares > 0 else 'SELL', ticker, abs(shares), prices[ticker], note)
+            report.append(message)
+            if filled:
+                deltas.append(self.position_delta(ticker))
+
+        self.record(*deltas)
+        return report
+
+    def trade(self, side, ticker, shares, price, note=''):
+        """Buys or sells shares of ticker at price if there is the cash or the shares for it. Returns (filled, message)"""
+        if side == 'BUY':
+            error = buy_error(ticker, shares, price, self.balance, note)
+            if error:
+                return False, error
+            cost = self.buy_shares(ticker, shares, price)
+            return True, f'Bought {shares} shares of {ticker}{note} at price ${price:.2f} for a total of ${cost:.2f}.'
+        error = sell_error(ticker, shares, self.owned_shares.get(ticker, 0), note)
+        if error:
+            return False, error
+        gain = self.sell_shares(ticker, shares, price)
+        return True, f'Sold {shares} shares of {ticker}{note} at price ${price:.2f} for a total of ${gain:.2f}.'
+
+    def buy_shares(self, ticker, shares, price):
+        """Adds shares at price to the position, updating cost basis and balance. Returns the cost"""
+        cost = shares * price
+
+        if ticker not in self.owned_shares:
+            self.owned_shares[ticker] = 0
+            self.cost_basis[ticker] = 0
+
+        prev_total = self.owned_shares[ticker] * self.cost_basis[ticker]
+
+        new_total = prev_total + cost
+
+        self.owned_shares[ticker] += shares
+
+        self.cost_basis[ticker] = new_total / self.owned_shares[ticker]
+
+        self.balance -= cost
+        return cost
+
+    def sell_shares(self, ticker, shares, price):
+        """Removes shares from the position at price, returns the proceeds"""
+        gain = shares * price
+        self.owned_shares[ticker] -= shares
+        self.balance += gain
+        if self.owned_shares[ticker] == 0:
+            self.owned_shares.pop(ticker, None)
+            self.cost_basis.pop(ticker, None)
+        return gain
+
+    def fill_buy_order(self, buy_order, prices, missing, market_open):
+        """Buys (or queues if market_open is False) buy_order at the given prices, returns list of messages"""
         buy_info = []
-        prices = self.get_curr_prices(buy_order)
-        if self.market_is_open():
+        deltas = []
+        for ticker in missing:
+            buy_info.append(f'No price found for {ticker}, skipping.')
+        if market_open:
             for ticker in prices:
-                cost = buy_order[ticker] * prices[ticker]
-                if cost < self.balance:
-
-                    if ticker not in self.owned_shares:
-                        self.owned_shares[ticker] = 0
-                        self.cost_basis[ticker] = 0
-
-                    prev_total = self.owned_shares[ticker] * self.cost_basis[ticker]
-
-                    new_total = prev_total + cost
-
-                    self.owned_shares[ticker] += buy_order[ticker]
-
-                    self.cost_basis[ticker] = new_total / self.owned_shares[ticker]
-
-                    self.balance -= cost
-
-                    buy_info.append(f'Bought {buy_order[ticker]} shares of {ticker} at price ${prices[ticker]:.2f} for a total of ${cost:.2f}.')
-
-                else:
-                    buy_info.append(f'Cannot afford {buy_order[ticker]} shares of {ticker} for total cost of ${cost:.2f}. Current balance: ${self.balance:.2f}')
+                filled, message = self.trade('BUY', ticker, buy_order[ticker], prices[ticker])
+                buy_info.append(message)
+                if filled:
+                    deltas.append(self.position_delta(ticker))
         else: # market not open, add order to queue
-            self.order_queue.append(('BUY', buy_order))
-            buy_info.append('Market not open, adding buy order to queue. Here is your order:')
+            queued = (self.new_order_id(), 'BUY', buy_order)
+            self.order_queue.append(queued)
+            deltas.append(('queue_add', queued))
+            buy_info.append(f'Market not open, adding buy order #{queued[0]} to queue. Here is your order:')
             for ticker in prices:
                 buy_info.append(f'BUY {buy_order[ticker]} shares of {ticker} at roughly ${prices[ticker]:.2f} per share for a total of ${(prices[ticker] * buy_order[ticker]):.2f}.')
+        self.record(*deltas)
         return buy_info
 
-    @save
-    def sell_stocks(self, sell_order):
-        """Takes dictionary sell_order, mapping from ticker symbol to number of shares to sell"""
+    def fill_sell_order(self, sell_order, prices, missing, market_open):
+        """Sells (or queues if market_open is False) sell_order at the given prices, returns list of messages"""
         sell_info = []
-        prices = self.get_curr_prices(sell_order)
-        if self.market_is_open():
+        deltas = []
+        for ticker in missing:
+            sell_info.append(f'No price found for {ticker}, skipping.')
+        if market_open:
             for ticker in prices:
-                if ticker not in self.owned_shares:
-                    sell_info.append(f'You do not own {ticker}.')
-                elif sell_order[ticker] > self.owned_shares[ticker]:
-                    sell_info.append(f'You have {self.owned_shares[ticker]} shares of {ticker} but tried to sell {sell_order[ticker]} shares.')
-                else:
-                    gain = sell_order[ticker] * prices[ticker]
-                    self.owned_shares[ticker] -= sell_order[ticker]
-                    self.balance += gain
-                    if self.owned_shares[ticker] == 0:
-                        self.owned_shares.pop(ticker, None)
-                        self.cost_basis.pop(ticker, None)
-                    sell_info.append(f'Sold {sell_order[ticker]} shares of {ticker} at price ${prices[ticker]:.2f} for a total of ${gain:.2f}.')
+                filled, message = self.trade('SELL', ticker, sell_order[ticker], prices[ticker])
+                sell_info.append(message)
+                if filled:
+                    deltas.append(self.position_delta(ticker))
         else: # market not open
-            self.order_queue.append(('SELL', sell_order))
-            sell_info.append('Market not open, adding sell order to queue. Here is your order:')
+            queued = (self.new_order_id(), 'SELL', sell_order)
+            self.order_queue.append(queued)
+            deltas.append(('queue_add', queued))
+            sell_info.append(f'Market not open, adding sell order #{queued[0]} to queue. Here is your order:')
             for ticker in prices:
                 sell_info.append(f'SELL {sell_order[ticker]} shares of {ticker} at roughly ${prices[ticker]:.2f} per share for a total of ${(prices[ticker] * sell_order[ticker]):.2f}.')
 
+        self.record(*deltas)
         return sell_info
 
-    def get_curr_val(self):
-        """Returns current portfolio value, updates portfolio history with current value"""
+    def value_at(self, prices):
+        """Returns portfolio value at the given prices, updates portfolio history with it"""
         total = self.balance
 
-        if self.owned_shares:
-            prices = self.get_curr_prices(self.owned_shares)
-            for ticker in self.owned_shares:
-                total += prices[ticker] * self.owned_shares[ticker]
+        for ticker in self.owned_shares:
+            total += prices[ticker] * self.owned_shares[ticker]
 
         self.update_history(total)
 
         return total
 
     def get_prev_close(self):
-        """Returns previous close value of the portfolio"""
-        prev_day = list(self.portfolio_history.keys())[-2]
-        return self.portfolio_history[prev_day]['close']
+        """Returns previous close value of the portfolio (today's open on the first day)"""
+        prev_close = self.portfolio_history.prev_close()
+        if prev_close is None:
+            last = self.portfolio_history.last_bar()
+            return float(last['open']) if last is not None else self.balance
+        return prev_close
 
-    @save
     def update_history(self, total):
-        d = date.today().strftime("%m/%d/%Y")
-        if d not in self.portfolio_history:
-            self.portfolio_history[d] = { 'open' : total, 'high' : total, 'low' : total, 'close' : total }
-        if total < self.portfolio_history[d]['low']:
-            self.portfolio_history[d]['low'] = total
-        if total > self.portfolio_history[d]['high']:
-            self.portfolio_history[d]['high'] = total
-
-        self.portfolio_history[d]['close'] = total
+        timestamp = time.time()
+        day, bar = self.portfolio_history.record(total, timestamp)
+        self.record(('history', day, bar, timestamp))
 
-
-    def market_is_open(self):
+    async def market_is_open_async(self):
+        """Answered from the local exchange calendar, checked against the API once per trading day"""
         if self.TEST_MODE:
             now = datetime.now()
             return (now.minute % 2 == 0)
-        
-        params = { 'apikey' : self.get_curr_key() }
-        response = self.make_request('https://financialmodelingprep.com/api/v3/is-the-market-open', params)
-        if response.status_code != 200:
-            raise Exception(f"Bad response code, response code {response.status_code}")
 
+        if MARKET_CALENDAR_RECONCILE and MARKET_CALENDAR.needs_reconcile():
+            MARKET_CALENDAR.reconcile(await self.fetch_market_is_open_async())
+        return MARKET_CALENDAR.is_open()
+
+    async def fetch_market_is_open_async(self):
+        """Asks the API whether the market is open"""
+        response = await self.make_request_async(MARKET_OPEN_URL, {})
         data = response.json()
         return data['isTheStockMarketOpen']
 
-    def save_chart_of_portfolio_history(self, time_span = 'M', file = "stonks.jpg"):
-        """time_span options: 'W' : week, 'M' : month, 'Y' : year, 'F' : full """
-        dates = []
-        open_prices = []
-        high_prices = []
-        low_prices = []
-        close_prices = []
-
-        if time_span == 'W':
-            delta = timedelta(days = -7)
-        elif time_span == 'M':
-            delta = timedelta(days = -30)
-        elif time_span == 'Y':
-            delta = timedelta(days = -365)
-        else:
-            delta = timedelta(days = -30) # default 
-        start_date_obj = datetime.now().date() + delta
-        for d in self.portfolio_history:
-            date_obj = datetime.strptime(d, "%m/%d/%Y").date()
-
-            if date_obj > start_date_obj or time_span == 'F':
-                dates.append(d)
-                open_prices.append(self.portfolio_history[d]['open'])
-                high_prices.append(self.portfolio_history[d]['high'])
-                low_prices.append(self.portfolio_history[d]['low'])
-                close_prices.append(self.portfolio_history[d]['close'])
-            
-        candlestick_data = [go.Candlestick(x=dates, open=open_prices, high=high_prices, low=low_prices, close=close_prices)]
-
-        layout = {'title' : 'Portfolio Value',
-                  'xaxis' : go.layout.XAxis(title=go.layout.xaxis.Title( text="Date")),
-                  'yaxis' : go.layout.YAxis(title=go.layout.yaxis.Title( text="Total Value"))}
-            
-        fig = go.Figure(data=candlestick_data, layout=layout)
-        fig.update_layout(xaxis_rangeslider_visible=False)
-
-        fig.write_image(file)
-
-    @save
-    def remove_order(self, idx):
-        order = self.order_queue[idx]
-        del self.order_queue[idx]
-        return order
+    def portfolio_chart_args(self, time_span = 'M'):
+        """Arguments for render.render_candlestick. time_span options: 'W' : week, 'M' : month, 'Y' : year, 'F' : full """
+        bars = self.portfolio_history.window(time_span)
+        dates = [date.fromordinal(int(d)).isoformat() for d in bars['date']]
+        return ('Portfolio Value', 'Total Value', dates, bars['open'].tolist(), bars['high'].tolist(), bars['low'].tolist(), bars['close'].tolist())
+
+    async def render_chart_of_portfolio_history_async(self, time_span = 'M'):
+        """Returns JPEG bytes of the portfolio value chart, rendered in the render pool"""
+        last = self.portfolio_history.last_bar()
+        last_date = last_bar = None
+        if last is not None:
+            last_date = int(last['date'])
+            last_bar = { 'o' : last['open'], 'h' : last['high'], 'l' : last['low'], 'c' : last['close'] }
+        key = chart_key('PORTFOLIO' if self.account is None else f'PORTFOLIO:{self.account}', time_span, last_date, last_bar)
+        image = CHART_CACHE.get(key)
+        if image is None:
+            image = await render.render_candlestick_async(*self.portfolio_chart_args(time_span))
+            CHART_CACHE.put(key, image)
+        return image
+
+    def new_order_id(self):
+        order_id = self.next_order_id
+        self.next_order_id += 1
+        return order_id
+
+    def cancel_order(self, order_id):
+        """Cancels a queued or resting order by id, returns its description (None if there is no such order)"""
+        for idx, entry in enumerate(self.order_queue):
+            if entry[0] == order_id:
+                del self.order_queue[idx]
+                self.record(('queue_cancel', order_id))
+                return describe_queued(entry)
+        order = self.resting_orders.remove(order_id)
+        if order is None:
+            return None
+        self.record(('order_cancel', order_id))
+        return order.describe()
+
+    def place_order(self, side, order_type, ticker, shares, trigger):
+        """Adds a limit or stop order to the resting book, returns a list of messages.
+        It fills at the first price check that crosses trigger, with cash and shares checked then"""
+        if side == 'SELL' and shares > self.owned_shares.get(ticker, 0):
+            return [f'You have {self.owned_shares.get(ticker, 0)} shares of {ticker} but tried to sell {shares} shares.']
+        order = RestingOrder(self.new_order_id(), side, order_type, ticker, shares, trigger)
+        self.resting_orders.add(order)
+        self.record(('order_add', order.as_tuple()))
+        return [f'Placed order {order.describe()}.']
+
+    def fill_resting_orders(self, prices):
+        """Fills the crossed resting orders at prices, oldest first, with a single journal write.
+        An order that can't be filled (not enough cash or shares) is cancelled"""
+        report = []
+        deltas = []
+        for order in self.resting_orders.crossed(prices):
+            self.resting_orders.remove(order.id)
+            price = prices[order.ticker]
+            total = order.shares * price
+            if order.side == 'BUY' and total >= self.balance:
+                deltas.append(('order_cancel', order.id))
+                report.append(f'Cancelled {order.describe()}: cannot afford {order.shares} shares of {order.ticker} for total cost of ${total:.2f}. Current balance: ${self.balance:.2f}')
+                continue
+            if order.side == 'SELL' and order.shares > self.owned_shares.get(order.ticker, 0):
+                deltas.append(('order_cancel', order.id))
+                report.append(f'Cancelled {order.describe()}: you have {self.owned_shares.get(order.ticker, 0)} shares of {order.ticker}.')
+                continue
+            if order.side == 'BUY':
+                self.buy_shares(order.ticker, order.shares, price)
+            else:
+                self.sell_shares(order.ticker, order.shares, price)
+            deltas += [('order_fill', order.id), self.position_delta(order.ticker)]
+            report.append(f'Filled {order.describe()} at price ${price:.2f} for a total of ${total:.2f}.')
+        self.record(*deltas)
+        return report
+
+    def position_delta(self, ticker):
+        """Journal delta setting ticker's position and the cash balance to their current values"""
+        return ('position', ticker, self.owned_shares.get(ticker, 0), self.cost_basis.get(ticker, 0), self.balance)
+
+    def record(self, *deltas):
+        """Appends deltas (already applied to this broker) to the journal, compacting into a snapshot every so often"""
+        if not deltas:
+            return
+        if self._journal.append(*deltas):
+            self.pickle_data()
+        if self.on_change is not None:
+            self.on_change()
+
+    def pending_tickers(self):
+        """Tickers of the queued and resting orders"""
+        return list(dict.fromkeys(queue_tickers(self.order_queue) + self.resting_orders.tickers()))
+
+    def close(self):
+        """Releases the journal file, the state stays on disk"""
+        self._journal.close()
+
+    def apply(self, delta):
+        """Replays one journal delta"""
+        kind = delta[0]
+        if kind == 'position':
+            _, ticker, shares, cost_basis, balance = delta
+            if shares:
+                self.owned_shares[ticker] = shares
+                self.cost_basis[ticker] = cost_basis
+            else:
+                self.owned_shares.pop(ticker, None)
+                self.cost_basis.pop(ticker, None)
+            self.balance = balance
+        elif kind == 'history':
+            if isinstance(delta[1], str): # ('history', '%m/%d/%Y', bar dict) from before the array history
+                bar = delta[2]
+                self.portfolio_history.set_bar(datetime.strptime(delta[1], "%m/%d/%Y").toordinal(), (bar['open'], bar['high'], bar['low'], bar['close']))
+            else:
+                _, day, bar, timestamp = delta
+                self.portfolio_history.add_sample(timestamp, bar[3])
+                self.portfolio_history.set_bar(day, bar)
+        elif kind == 'queue_add':
+            entry = delta[1]
+            if len(entry) == 2: # (type, order) from before order ids
+                entry = (self.new_order_id(), *entry)
+            self.next_order_id = max(self.next_order_id, entry[0] + 1)
+            self.order_queue.append(entry)
+        elif kind == 'queue_remove': # positional, from before order ids
+            del self.order_queue[delta[1]]
+        elif kind == 'queue_cancel':
+            self.order_queue = deque(entry for entry in self.order_queue if entry[0] != delta[1])
+        elif kind == 'order_add':
+            order = RestingOrder(*delta[1])
+            self.next_order_id = max(self.next_order_id, order.id + 1)
+            self.resting_orders.add(order)
+        elif kind in ('order_fill', 'order_cancel'):
+            self.resting_orders.remove(delta[1])
+        elif kind == 'queue_pop':
+            for i in range(delta[1]):
+                self.order_queue.popleft()
 
     def pickle_data(self):
-        print("saving data")
+        """Writes a full snapshot and truncates the journal"""
+        print("saving snapshot")
         data = {
             'balance': self.balance,
             'owned_shares': self.owned_shares,
             'cost_basis': self.cost_basis,
             'portfolio_history': self.portfolio_history,
-            'order_queue': self.order_queue
+            'order_queue': self.order_queue,
+            'resting_orders': self.resting_orders,
+            'next_order_id': self.next_order_id
         }
-        with open('broker.pickle', 'wb') as f:
-            pickle.dump(data, f)
+        self._journal.snapshot(data)
 
     def load_data(self):
-        try:
-            with open('broker.pickle', 'rb') as f:
-                data = pickle.load(f)
-                self.balance = data['balance']
-                self.owned_shares = data['owned_shares']
-                self.cost_basis = data['cost_basis']
-                self.portfolio_history = data['portfolio_history']
-                self.order_queue = data['order_queue']
-        except:
-            pass
\ No newline at end of file
+        data, deltas = self._journal.load()
+        if data is not None:
+            self.balance = data['balance']
+            self.owned_shares = data['owned_shares']
+            self.cost_basis = data['cost_basis']
+            self.portfolio_history = data['portfolio_history']
+            if isinstance(self.portfolio_history, dict):
+                self.portfolio_history = PortfolioHistory.from_dict(self.portfolio_history)
+            self.resting_orders = data.get('resting_orders', OrderBook())
+            self.next_order_id = data.get('next_order_id', 1)
+            self.order_queue = deque(entry if len(entry) == 3 else (self.new_order_id(), *entry) for entry in data['order_queue'])
+        for delta in deltas:
+            self.apply(delta)
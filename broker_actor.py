@@ -0,0 +1,117 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import takewhile
+import metrics
+from broker import Broker, queue_tickers
+
+# the one thread every Broker change runs on, so changes (and their journal writes) never overlap, even across accounts
+BROKER_WORKER = ThreadPoolExecutor(max_workers=1, thread_name_prefix='broker')
+
+
+class BrokerView():
+    """Copy of a Broker's state between two changes, for reading without waiting on the worker"""
+
+    # these only read the history (and the account name), so the Broker versions work on a view too
+    portfolio_chart_args = Broker.portfolio_chart_args
+    render_chart_of_portfolio_history_async = Broker.render_chart_of_portfolio_history_async
+    get_prev_close = Broker.get_prev_close
+
+    def __init__(self, broker):
+        self.account = broker.account
+        self.balance = broker.balance
+        self.owned_shares = dict(broker.owned_shares)
+        self.cost_basis = dict(broker.cost_basis)
+        self.order_queue = list(broker.order_queue)
+        self.resting_orders = list(broker.resting_orders.orders.values())
+        self.portfolio_history = broker.portfolio_history.daily_copy()
+
+    def pending_tickers(self):
+        return list(dict.fromkeys(queue_tickers(self.order_queue) + [order.ticker for order in self.resting_orders]))
+
+
+class BrokerActor():
+    """Runs every change to a Broker on BROKER_WORKER, in the order they were asked for, and publishes a new view
+    after each one. Prices and market hours are fetched on the event loop first, so the worker only fills orders
+    and writes the journal. Reads use view, which is replaced (never modified) by the worker"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.view = BrokerView(broker)
+
+    @property
+    def account(self):
+        return self.broker.account
+
+    def _run(self, func, *args):
+        try:
+            return func(*args)
+        finally:
+            self.view = BrokerView(self.broker)
+
+    async def submit(self, func, *args):
+        """Runs func(*args) on the worker after the changes already submitted, returns its result"""
+        loop = asyncio.get_running_loop()
+        with metrics.timer('broker_command_seconds'):
+            return await loop.run_in_executor(BROKER_WORKER, self._run, func, *args)
+
+    async def buy(self, buy_order):
+        """Buys (or queues) buy_order, a dict of ticker -> shares. Returns a list of messages"""
+        prices, missing = await self.broker.get_curr_prices_and_missing_async(buy_order)
+        return await self.submit(self.broker.fill_buy_order, buy_order, prices, missing, await self.broker.market_is_open_async())
+
+    async def sell(self, sell_order):
+        """Sells (or queues) sell_order, a dict of ticker -> shares. Returns a list of messages"""
+        prices, missing = await self.broker.get_curr_prices_and_missing_async(sell_order)
+        return await self.submit(self.broker.fill_sell_order, sell_order, prices, missing, await self.broker.market_is_open_async())
+
+    def _value_at(self, prices):
+        if not prices.keys() >= self.broker.owned_shares.keys():
+            return None
+        return self.broker.value_at(prices)
+
+    async def valuation(self, prices=None):
+        """Portfolio value at prices (fetched if None), also recorded in the portfolio history.
+        None if a holding has no price (nothing is recorded then)"""
+        held = set(self.view.owned_shares)
+        for attempt in range(2):
+            if prices is None:
+                tickers = list(self.view.owned_shares)
+                prices = await self.broker.get_curr_prices_async(tickers) if tickers else {}
+            total = await self.submit(self._value_at, prices)
+            if total is not None or set(self.view.owned_shares) <= held:
+                return total
+            # bought something new since the prices were fetched, price the new holdings once
+            held = set(self.view.owned_shares)
+            prices = None
+        return None
+
+    def _fill_queue(self, order_ids, prices, missing):
+        # orders only leave the queue by being filled or cancelled and new ones go at the back,
+        # so the ones still there out of the priced orders are at the front
+        orders = list(takewhile(lambda entry: entry[0] in order_ids, self.broker.order_queue))
+        return self.broker.fill_queue_orders(orders, prices, missing) if orders else []
+
+    async def execute_queue(self):
+        """Executes the order queue if the market is open, returns a list of report lines"""
+        queued = self.view.order_queue
+        if not queued or not await self.broker.market_is_open_async():
+            return []
+        prices, missing = await self.broker.get_curr_prices_and_missing_async(queue_tickers(queued))
+        return await self.submit(self._fill_queue, { entry[0] for entry in queued }, prices, missing)
+
+    async def match_orders(self):
+        """Fills the limit and stop orders whose trigger has been crossed if the market is open, returns a list of report lines"""
+        tickers = list(dict.fromkeys(order.ticker for order in self.view.resting_orders))
+        if not tickers or not await self.broker.market_is_open_async():
+            return []
+        return await self.submit(self.broker.fill_resting_orders, await self.broker.get_curr_prices_async(tickers))
+
+    async def place_order(self, side, order_type, ticker, shares, trigger):
+        return await self.submit(self.broker.place_order, side, order_type, ticker, shares, trigger)
+
+    async def cancel_order(self, order_id):
+        return await self.submit(self.broker.cancel_order, order_id)
+
+    def close(self):
+        """Closes the Broker once the changes already submitted are done"""
+        BROKER_WORKER.submit(self.broker.close)
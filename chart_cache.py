@@ -0,0 +1,136 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from dotenv import load_dotenv
+
+load_dotenv()
+CHART_CACHE_DIR = os.getenv('CHART_CACHE_DIR', 'chart_cache')
+CHART_CACHE_MEMORY_MB = float(os.getenv('CHART_CACHE_MEMORY_MB', '32'))
+CHART_CACHE_DISK_MB = float(os.getenv('CHART_CACHE_DISK_MB', '256'))
+CHART_CACHE_PRICE_DIGITS = int(os.getenv('CHART_CACHE_PRICE_DIGITS', '4')) # significant digits of the realtime candle in the key
+
+
+def round_price(price):
+    """Rounds price to CHART_CACHE_PRICE_DIGITS significant digits, so tiny realtime moves reuse the same chart"""
+    return float(f'{price:.{CHART_CACHE_PRICE_DIGITS}g}')
+
+def chart_key(ticker, time_span, last_date, realtime=None):
+    """Cache key for a chart. last_date is the newest stored bar, realtime is the live candle dict (o, h, l, c) if any.
+    Today's date is part of the key since the start of the time span moves with it"""
+    candle = None
+    if realtime is not None:
+        candle = tuple(round_price(realtime[field]) for field in ('o', 'h', 'l', 'c'))
+    return (ticker, time_span, date.today().toordinal(), last_date, candle)
+
+
+class ChartCache():
+
+    def __init__(self, directory=CHART_CACHE_DIR, memory_bytes=CHART_CACHE_MEMORY_MB * 2**20, disk_bytes=CHART_CACHE_DISK_MB * 2**20):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict() # key -> image bytes, least recently used first
+        self._memory_size = 0
+        self._disk = None # file name -> size, least recently used first, read from the directory on first use
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached image for key, or None"""
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return image
+
+            name = self._file_name(key)
+            if name in self._disk_index():
+                try:
+                    with open(os.path.join(self.directory, name), 'rb') as f:
+                        image = f.read()
+                except OSError:
+                    self._drop_file(name)
+                else:
+                    self._disk.move_to_end(name)
+                    self._put_memory(key, image)
+                    self.disk_hits += 1
+                    return image
+
+            self.misses += 1
+            return None
+
+    def put(self, key, image):
+        with self._lock:
+            self._put_memory(key, image)
+
+            name = self._file_name(key)
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = os.path.join(self.directory, name + '.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(image)
+            os.replace(tmp, os.path.join(self.directory, name))
+
+            index = self._disk_index()
+            self._disk_size -= index.pop(name, 0)
+            index[name] = len(image)
+            self._disk_size += len(image)
+            while self._disk_size > self.disk_bytes and len(index) > 1:
+                self._drop_file(next(iter(index)))
+
+    def clear(self):
+        """Drops every cached chart, in memory and on disk"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            for name in list(self._disk_index()):
+                self._drop_file(name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_size,
+                'disk_bytes': self._disk_size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+    def _put_memory(self, key, image):
+        self._memory_size -= len(self._memory.pop(key, b''))
+        self._memory[key] = image
+        self._memory_size += len(image)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            self._memory_size -= len(self._memory.popitem(last=False)[1])
+
+    def _disk_index(self):
+        if self._disk is None:
+            self._disk = OrderedDict()
+            self._disk_size = 0
+            if os.path.isdir(self.directory):
+                entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.jpg')]
+                for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+                    self._disk[entry.name] = entry.stat().st_size
+                    self._disk_size += entry.stat().st_size
+        return self._disk
+
+    def _drop_file(self, name):
+        self._disk_size -= self._disk.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _file_name(self, key):
+        return hashlib.sha1(repr(key).encode()).hexdigest() + '.jpg'
+
+
+CHART_CACHE = ChartCache()
@@ -1,81 +1,61 @@
-import requests
-import json
-import os
+import asyncio
 from datetime import datetime, date, timedelta
-from dotenv import load_dotenv
-import plotly.graph_objs as go
-
-load_dotenv()
-ALPHAVANTAGE_KEY = os.getenv('ALPHAVANTAGE_KEY')
-
-
-def save_chart(ticker, realtime=None, time_span = 'M', file = "stonks.jpg"):
-    ticker = ticker.upper()   
-    params = {
-        'apikey'     : ALPHAVANTAGE_KEY,
-        'function'   : 'TIME_SERIES_DAILY_ADJUSTED',
-        'symbol'     : ticker,
-        'outputsize' : 'full'
-    }
-
-    response = requests.get('https://www.alphavantage.co/query', params)
-
-    if response.status_code != 200:
-        raise Exception("wtf")
-
-    data = response.json()
-
-    if 'Error Message' in data:
-        print(f"save_chart: ticker {ticker} not found")
-        return False
-    else:
-        dates = []
-        open_prices = []
-        high_prices = []
-        low_prices = []
-        close_prices = []
-
-        if realtime is not None:
-            today = date.today().strftime("%Y-%m-%d")
-            dates.append(today)
-            open_prices.append(realtime['o'])
-            high_prices.append(realtime['h'])
-            low_prices.append(realtime['l'])
-            close_prices.append(realtime['c'])
-
-        if time_span == 'W':
-            delta = timedelta(days = -7)
-        elif time_span == 'M':
-            delta = timedelta(days = -30)
-        elif time_span == 'Y':
-            delta = timedelta(days = -365)
-        else:
-            delta = timedelta(days = -7) # default 
-        start_date_obj = datetime.now().date() + delta
-
-        for d in data['Time Series (Daily)']:
-            date_obj = datetime.strptime(d, "%Y-%m-%d").date()
-
-            if date_obj > start_date_obj or time_span == 'F':
-                dates.append(d)
-                open_prices.append(data['Time Series (Daily)'][d]['1. open'])
-                high_prices.append(data['Time Series (Daily)'][d]['2. high'])
-                low_prices.append(data['Time Series (Daily)'][d]['3. low'])
-                close_prices.append(data['Time Series (Daily)'][d]['4. close'])
-            
-        candlestick_data = [go.Candlestick(x=dates, open=open_prices, high=high_prices, low=low_prices, close=close_prices)]
-
-        layout = {'title' : data['Meta Data']['2. Symbol'],
-                  'xaxis' : go.layout.XAxis(title=go.layout.xaxis.Title( text="Date")),
-                  'yaxis' : go.layout.YAxis(title=go.layout.yaxis.Title( text="Price"))}
-            
-        fig = go.Figure(data=candlestick_data, layout=layout)
-        fig.update_layout(xaxis_rangeslider_visible=False)
-
-        fig.write_image(file)
-        print("success")
-        return True
+import render
+from history_store import HISTORY_STORE, since
+from chart_cache import CHART_CACHE, chart_key
+from portfolio_history import SPAN_DAYS
+
+
+async def render_chart_async(ticker, realtime=None, time_span = 'M'):
+    """Returns a JPEG candlestick chart of ticker as bytes, or None if the ticker wasn't found. Renders in the render pool"""
+    ticker = ticker.upper()
+    bars = await HISTORY_STORE.get_async(ticker)
+    key = bars_key(ticker, bars, realtime, time_span)
+    image = CHART_CACHE.get(key)
+    if image is None:
+        args = chart_args(ticker, bars, realtime, time_span)
+        if args is None:
+            return None
+        image = await render.render_candlestick_async(*args)
+        CHART_CACHE.put(key, image)
+    return image
+
+def bars_key(ticker, bars, realtime, time_span):
+    last_date = int(bars['date'][-1]) if bars is not None and len(bars) else None
+    return chart_key(ticker, time_span, last_date, realtime)
+
+def chart_args(ticker, bars, realtime, time_span):
+    """Arguments for render.render_candlestick from the stored daily bars, None if the ticker wasn't found"""
+    if bars is None:
+        print(f"render_chart_async: ticker {ticker} not found")
+        return None
+
+    if time_span != 'F':
+        start_date_obj = datetime.now().date() - timedelta(days = SPAN_DAYS.get(time_span, 7)) # default week
+        bars = since(bars, start_date_obj)
+
+    today = date.today()
+    if realtime is not None and len(bars) and bars['date'][-1] == today.toordinal():
+        bars = bars[:-1] # realtime candle replaces today's stored bar
+
+    dates = [date.fromordinal(int(d)).isoformat() for d in bars['date']]
+    open_prices = bars['open'].tolist()
+    high_prices = bars['high'].tolist()
+    low_prices = bars['low'].tolist()
+    close_prices = bars['close'].tolist()
+
+    if realtime is not None:
+        dates.append(today.isoformat())
+        open_prices.append(realtime['o'])
+        high_prices.append(realtime['h'])
+        low_prices.append(realtime['l'])
+        close_prices.append(realtime['c'])
+
+    return (ticker, "Price", dates, open_prices, high_prices, low_prices, close_prices)
 
 if __name__ == '__main__':
     ticker = input('Enter ticker\n').upper()
-    save_chart(ticker, time_span='Y')
\ No newline at end of file
+    image = asyncio.run(render_chart_async(ticker, time_span='Y'))
+    if image:
+        with open('stonks.jpg', 'wb') as f:
+            f.write(image)
@@ -0,0 +1,61 @@
+import json
+import os
+import time
+from dotenv import load_dotenv
+from http_client import FINANCIALMODELING_URL
+from key_scheduler import get_scheduler
+
+load_dotenv()
+CONSTITUENTS_FILE = os.getenv('CONSTITUENTS_FILE', 'sp500.json')
+CONSTITUENTS_MAX_AGE_SECS = int(os.getenv('CONSTITUENTS_MAX_AGE_DAYS', '7')) * 24 * 3600
+CONSTITUENTS_URL = FINANCIALMODELING_URL + 'sp500_constituent'
+
+
+class Constituents():
+    """S&P 500 members ({ 'symbol', 'name', 'sector' } each), kept in a local file and refreshed weekly"""
+
+    def __init__(self, path=CONSTITUENTS_FILE, max_age=CONSTITUENTS_MAX_AGE_SECS):
+        self.path = path
+        self.max_age = max_age
+        self._members = None
+        self._loaded = 0 # time the list was fetched
+
+    def load(self):
+        """Members from the local file, or None if there is none"""
+        if self._members is None:
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+            self._members, self._loaded = data['members'], data['fetched']
+        return self._members
+
+    def stale(self):
+        return self.load() is None or time.time() - self._loaded > self.max_age
+
+    def store(self, data):
+        """Keeps the members from a sp500_constituent response and writes them out. Returns the members"""
+        if not isinstance(data, list) or not data:
+            return self.load() # keep the old list if the fetch returned an error
+        members = [{ 'symbol' : row['symbol'], 'name' : row.get('name', ''), 'sector' : row.get('sector') or 'Other' } for row in data]
+        self._members, self._loaded = members, time.time()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({ 'fetched' : self._loaded, 'members' : members }, f)
+        os.replace(tmp, self.path)
+        return members
+
+    async def get_async(self):
+        """Members, fetched again if the local list is missing or older than max_age"""
+        if not self.stale():
+            return self._members
+        try:
+            response = await get_scheduler('fmp').get_async(CONSTITUENTS_URL, {})
+            return self.store(response.json())
+        except Exception as e:
+            print(f"constituents: refresh failed: {e!r}")
+            return self.load() or []
+
+
+SP500 = Constituents()
@@ -0,0 +1,222 @@
+"""Local stand-in for the Finnhub, AlphaVantage and financialmodelingprep APIs, for benchmarking without real keys.
+
+    python fake_upstream.py --port 8765 --latency 0.05 --error-rate 0.01 --throttle-rate 0.01
+
+then point the bot at it with FINNHUB_URL=http://127.0.0.1:8765/finnhub/, ALPHAVANTAGE_URL=http://127.0.0.1:8765/alphavantage/query,
+FINANCIALMODELING_URL=http://127.0.0.1:8765/fmp/ and FINNHUB_WS_URL=ws://127.0.0.1:8765/finnhub-ws (see urls())
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+from aiohttp import web
+
+SYMBOL = re.compile(r'^[A-Z][A-Z.\-]{0,5}$')
+
+
+def base_price(symbol):
+    return 10 + zlib.crc32(symbol.encode()) % 500
+
+def business_days(n, end=None):
+    """The last n weekdays before end (default today), oldest first"""
+    d = (end or date.today()) - timedelta(days=1)
+    days = []
+    while len(days) < n:
+        if d.weekday() < 5:
+            days.append(d)
+        d -= timedelta(days=1)
+    return days[::-1]
+
+
+class FakeUpstream():
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, market_open=True, history_days=5000, missing_prefix='ZZ', batch_drop_rate=0.0, trade_interval=1.0):
+        """latency/jitter in seconds per request, error_rate and throttle_rate are the chance of a 500 or 429 response.
+        Symbols starting with missing_prefix don't exist, batch_drop_rate is the chance a symbol is left out of a multi-symbol quote.
+        The trade websocket sends a trade for every subscribed symbol each trade_interval seconds"""
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.market_open = market_open
+        self.history_days = history_days
+        self.missing_prefix = missing_prefix
+        self.batch_drop_rate = batch_drop_rate
+        self.trade_interval = trade_interval
+        self._sockets = set()
+        self.sp500 = [a + b + c for a in 'ABCDEFGHIJ' for b in 'KLMNOPQRST' for c in 'UVWXY'] # 500 made up index members
+
+        self.calls = Counter() # route name -> requests served (including injected errors)
+        self._daily = {} # (symbol, outputsize) -> response text
+        self.runner = None
+        self.port = None
+
+    def exists(self, symbol):
+        return bool(SYMBOL.match(symbol)) and not symbol.startswith(self.missing_prefix)
+
+    def price(self, symbol):
+        return round(base_price(symbol) * (1 + random.uniform(-0.01, 0.01)), 2)
+
+    async def _simulate(self, route):
+        """Counts the call, sleeps for the configured latency and returns an injected error response, if any"""
+        self.calls[route] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < self.throttle_rate:
+            return web.json_response({ 'Error Message' : 'Too many requests' }, status=429, headers={ 'Retry-After' : '1' })
+        if random.random() < self.error_rate:
+            return web.json_response({ 'Error Message' : 'Internal error' }, status=500)
+        return None
+
+    async def fmp_quote(self, request):
+        error = await self._simulate('fmp_quote')
+        if error:
+            return error
+        quotes = []
+        for symbol in request.match_info['symbols'].split(','):
+            if self.exists(symbol) and not (',' in request.match_info['symbols'] and random.random() < self.batch_drop_rate):
+                price = self.price(symbol)
+                quotes.append({ 'symbol' : symbol, 'price' : price, 'previousClose' : base_price(symbol),
+                                'changesPercentage' : round((price / base_price(symbol) - 1) * 100, 2),
+                                'marketCap' : base_price(symbol) * 1e9 })
+        return web.json_response(quotes)
+
+    async def fmp_sp500(self, request):
+        error = await self._simulate('fmp_sp500')
+        if error:
+            return error
+        sectors = ('Information Technology', 'Health Care', 'Financials', 'Consumer Discretionary', 'Communication Services',
+                   'Industrials', 'Consumer Staples', 'Energy', 'Utilities', 'Real Estate', 'Materials')
+        return web.json_response([{ 'symbol' : symbol, 'name' : symbol + ' Inc.', 'sector' : sectors[zlib.crc32(symbol.encode()) % len(sectors)] }
+                                  for symbol in self.sp500])
+
+    async def fmp_market_open(self, request):
+        error = await self._simulate('fmp_market_open')
+        return error or web.json_response({ 'isTheStockMarketOpen' : self.market_open })
+
+    async def finnhub_quote(self, request):
+        error = await self._simulate('finnhub_quote')
+        if error:
+            return error
+        symbol = request.query.get('symbol', '')
+        if not self.exists(symbol):
+            return web.json_response({ 'c' : 0, 'd' : None, 'dp' : None, 'h' : 0, 'l' : 0, 'o' : 0, 'pc' : 0, 't' : 0 })
+        price = self.price(symbol)
+        prev = base_price(symbol)
+        return web.json_response({ 'c' : price, 'h' : max(price, prev) * 1.01, 'l' : min(price, prev) * 0.99, 'o' : prev, 'pc' : prev, 't' : 0 })
+
+    async def alphavantage(self, request):
+        function = request.query.get('function')
+        symbol = request.query.get('symbol', '')
+        error = await self._simulate('alphavantage_' + str(function).lower())
+        if error:
+            return error
+        if not self.exists(symbol):
+            return web.json_response({ 'Error Message' : 'Invalid API call.' })
+        if function == 'OVERVIEW':
+            return web.json_response({ 'Symbol' : symbol, 'Name' : symbol + ' Inc.', 'Sector' : 'TECHNOLOGY',
+                                       'Description' : f'{symbol} Inc. is a company that makes things. ' + 'It does so at scale. ' * 40 })
+        if function == 'TIME_SERIES_DAILY_ADJUSTED':
+            outputsize = request.query.get('outputsize', 'compact')
+            return web.Response(text=self.daily(symbol, outputsize), content_type='application/json')
+        return web.json_response({ 'Error Message' : 'Unknown function' })
+
+    async def finnhub_ws(self, request):
+        self.calls['finnhub_ws'] += 1
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self._sockets.add(ws)
+        subscribed = set()
+
+        async def feed():
+            while True:
+                await asyncio.sleep(self.trade_interval)
+                if subscribed:
+                    trades = [{ 's' : symbol, 'p' : self.price(symbol), 't' : 0, 'v' : 100 } for symbol in subscribed]
+                    await ws.send_str(json.dumps({ 'type' : 'trade', 'data' : trades }))
+
+        feeder = asyncio.ensure_future(feed())
+        try:
+            async for msg in ws:
+                data = json.loads(msg.data)
+                if data.get('type') == 'subscribe' and self.exists(data.get('symbol', '')):
+                    subscribed.add(data['symbol'])
+                elif data.get('type') == 'unsubscribe':
+                    subscribed.discard(data.get('symbol'))
+        finally:
+            feeder.cancel()
+            self._sockets.discard(ws)
+        return ws
+
+    async def drop_streams(self):
+        """Closes every open websocket, to exercise reconnects"""
+        for ws in list(self._sockets):
+            await ws.close()
+
+    def daily(self, symbol, outputsize):
+        if (symbol, outputsize) not in self._daily:
+            days = business_days(self.history_days if outputsize == 'full' else 100)
+            rng = random.Random(symbol)
+            price = base_price(symbol)
+            series = {}
+            for d in days:
+                o = price
+                price = max(1, price * (1 + rng.gauss(0, 0.02)))
+                series[d.isoformat()] = { '1. open' : f'{o:.4f}', '2. high' : f'{max(o, price) * 1.01:.4f}',
+                                          '3. low' : f'{min(o, price) * 0.99:.4f}', '4. close' : f'{price:.4f}',
+                                          '5. adjusted close' : f'{price:.4f}', '6. volume' : '1000000' }
+            newest_first = dict(reversed(list(series.items())))
+            self._daily[(symbol, outputsize)] = json.dumps({ 'Meta Data' : { '2. Symbol' : symbol }, 'Time Series (Daily)' : newest_first })
+        return self._daily[(symbol, outputsize)]
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/fmp/quote/{symbols}', self.fmp_quote)
+        app.router.add_get('/fmp/is-the-market-open', self.fmp_market_open)
+        app.router.add_get('/fmp/sp500_constituent', self.fmp_sp500)
+        app.router.add_get('/finnhub/quote', self.finnhub_quote)
+        app.router.add_get('/alphavantage/query', self.alphavantage)
+        app.router.add_get('/finnhub-ws', self.finnhub_ws)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Starts serving, port 0 picks a free port. Returns the port"""
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        await self.drop_streams()
+        await self.runner.cleanup()
+
+    def urls(self, host='127.0.0.1'):
+        """Environment variables that point the bot at this server"""
+        base = f'http://{host}:{self.port}/'
+        return {
+            'FINNHUB_URL' : base + 'finnhub/',
+            'ALPHAVANTAGE_URL' : base + 'alphavantage/query',
+            'FINANCIALMODELING_URL' : base + 'fmp/',
+            'FINNHUB_WS_URL' : f'ws://{host}:{self.port}/finnhub-ws'
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Finnhub/AlphaVantage/FMP server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--market-closed', action='store_true')
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.latency, args.jitter, args.error_rate, args.throttle_rate, not args.market_closed)
+    web.run_app(upstream.app(), host='127.0.0.1', port=args.port)
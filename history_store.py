@@ -0,0 +1,119 @@
+import asyncio
+import os
+from datetime import date, timedelta
+import numpy as np
+from dotenv import load_dotenv
+from http_client import ALPHAVANTAGE_URL
+from key_scheduler import get_scheduler
+
+load_dotenv()
+HISTORY_DIR = os.getenv('HISTORY_DIR', 'history')
+COMPACT_BARS = 100 # trading days in an outputsize=compact response
+COMPACT_MARGIN = 10 # top up with 'full' this many weekdays before the gap could outgrow 'compact'
+
+# one row per trading day, date is date.toordinal()
+BAR_DTYPE = np.dtype([('date', 'i4'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8')])
+
+
+def parse_daily(data):
+    """Turns a TIME_SERIES_DAILY_ADJUSTED response into a bar array sorted by date, or None if the ticker wasn't found"""
+    if 'Error Message' in data or 'Time Series (Daily)' not in data:
+        return None
+    series = data['Time Series (Daily)']
+    bars = np.empty(len(series), dtype=BAR_DTYPE)
+    for i, (d, bar) in enumerate(series.items()):
+        bars[i] = (date.fromisoformat(d).toordinal(), bar['1. open'], bar['2. high'], bar['3. low'], bar['4. close'])
+    bars.sort(order='date')
+    return bars
+
+def last_complete_day(today=None):
+    """Most recent weekday before today, the newest bar the daily endpoint can be expected to have"""
+    d = (today or date.today()) - timedelta(days=1)
+    while d.weekday() >= 5:
+        d -= timedelta(days=1)
+    return d
+
+def since(bars, start_date):
+    """Bars strictly after start_date, found by binary search on the date column"""
+    idx = np.searchsorted(bars['date'], start_date.toordinal(), side='right')
+    return bars[idx:]
+
+
+class HistoryStore():
+
+    def __init__(self, directory=HISTORY_DIR):
+        self.directory = directory
+        self._checked = {} # ticker -> date of the last compact top-up, so holidays cost one fetch a day
+        self._locks = {}
+        self._bars = {} # ticker -> bars, so each file is read from disk once
+
+    def path(self, ticker):
+        return os.path.join(self.directory, ticker + '.npy')
+
+    def load(self, ticker):
+        """Stored bars for ticker, or None if there are none"""
+        if ticker not in self._bars:
+            try:
+                self._bars[ticker] = np.load(self.path(ticker))
+            except FileNotFoundError:
+                return None
+        return self._bars[ticker]
+
+    def needs_update(self, ticker, bars):
+        """Returns the outputsize to fetch ('full' or 'compact'), or None if the stored bars are current"""
+        if bars is None or len(bars) == 0:
+            return 'full'
+        last_stored, last_complete = date.fromordinal(int(bars['date'][-1])), last_complete_day()
+        if last_stored >= last_complete or self._checked.get(ticker) == date.today():
+            return None
+        # weekdays are at least the trading days missing, so this errs towards 'full'
+        if np.busday_count(last_stored + timedelta(days=1), last_complete + timedelta(days=1)) > COMPACT_BARS - COMPACT_MARGIN:
+            return 'full'
+        return 'compact'
+
+    async def get_async(self, ticker):
+        """Returns up to date bars for ticker, fetching only what's missing. None if the ticker wasn't found.
+        Concurrent calls for the same ticker share one download"""
+        lock = self._locks.setdefault(ticker, asyncio.Lock())
+        async with lock:
+            bars = self.load(ticker)
+            outputsize = self.needs_update(ticker, bars)
+            if outputsize is None:
+                return bars
+
+            response = await get_scheduler('alphavantage').get_async(ALPHAVANTAGE_URL, daily_params(ticker, outputsize))
+            if response.status_code != 200:
+                raise Exception(f"Bad response code, response code {response.status_code}")
+            return self.merge(ticker, bars, parse_daily(response.json()))
+
+    def merge(self, ticker, bars, new_bars):
+        """Adds new_bars to the stored bars for ticker and writes them out. Bars after last_complete_day are left out,
+        during market hours the daily series ends with today's unfinished bar and stored bars are never revisited"""
+        if new_bars is None:
+            return bars # ticker not found, or keep what we have if a top-up fails
+        self._checked[ticker] = date.today()
+        new_bars = new_bars[new_bars['date'] <= last_complete_day().toordinal()]
+        if bars is not None and len(bars):
+            new_bars = new_bars[new_bars['date'] > bars['date'][-1]]
+            if len(new_bars) == 0:
+                return bars
+            new_bars = np.concatenate([bars, new_bars])
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(ticker) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, new_bars)
+        os.replace(tmp, self.path(ticker))
+        self._bars[ticker] = new_bars
+        return new_bars
+
+
+def daily_params(ticker, outputsize):
+    return {
+        'function'   : 'TIME_SERIES_DAILY_ADJUSTED',
+        'symbol'     : ticker,
+        'outputsize' : outputsize
+    }
+
+
+HISTORY_STORE = HistoryStore()
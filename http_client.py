@@ -0,0 +1,64 @@
+import asyncio
+import json
+import os
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+FINNHUB_URL = os.getenv('FINNHUB_URL', 'https://finnhub.io/api/v1/')
+ALPHAVANTAGE_URL = os.getenv('ALPHAVANTAGE_URL', 'https://www.alphavantage.co/query')
+FINANCIALMODELING_URL = os.getenv('FINANCIALMODELING_URL', 'https://financialmodelingprep.com/api/v3/')
+
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '20')) # max open connections per provider
+HTTP_KEEPALIVE_SECS = float(os.getenv('HTTP_KEEPALIVE_SECS', '30'))
+
+# total seconds per request, AlphaVantage full daily history downloads are slow
+TIMEOUTS = {
+    'finnhub'      : float(os.getenv('FINNHUB_TIMEOUT_SECS', '10')),
+    'fmp'          : float(os.getenv('FINANCIALMODELING_TIMEOUT_SECS', '10')),
+    'alphavantage' : float(os.getenv('ALPHAVANTAGE_TIMEOUT_SECS', '60'))
+}
+
+_sessions = {}
+
+
+class Response():
+    """Enough of the requests.Response interface for the code that handles responses to work on either"""
+
+    def __init__(self, status_code, text, headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def get_session(provider):
+    """Returns the keep-alive session for provider ('finnhub', 'fmp' or 'alphavantage'), creating it on first use.
+    Must be called from inside the running event loop"""
+    session = _sessions.get(provider)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=HTTP_KEEPALIVE_SECS, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=TIMEOUTS.get(provider, 30))
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _sessions[provider] = session
+    return session
+
+
+async def get(provider, url, params=None, timeout=None):
+    """GETs url on the pooled session for provider, returns a Response. timeout overrides the provider default"""
+    params = { key : str(value) for key, value in (params or {}).items() }
+    kwargs = {}
+    if timeout is not None:
+        kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+    async with get_session(provider).get(url, params=params, **kwargs) as response:
+        text = await response.text()
+        return Response(response.status, text, dict(response.headers))
+
+
+async def close():
+    """Closes all provider sessions"""
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    await asyncio.gather(*(session.close() for session in sessions if not session.closed))
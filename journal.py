@@ -0,0 +1,103 @@
+import os
+import pickle
+import struct
+import zlib
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '1000')) # deltas between snapshots
+JOURNAL_FSYNC = (os.getenv('JOURNAL_FSYNC') == 'True')
+
+# each record is length, crc32 of the payload, then the pickled (sequence number, list of deltas)
+_HEADER = struct.Struct('<II')
+
+
+class Journal():
+    """Snapshot file plus an append-only log of the deltas applied since that snapshot"""
+
+    def __init__(self, snapshot_path='broker.pickle', journal_path='broker.journal', compact_every=JOURNAL_COMPACT_EVERY):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.deltas_since_snapshot = 0
+        self.seq = 0 # sequence number of the last record, snapshots store it so records already in a snapshot are skipped
+        self._file = None
+
+    def load(self):
+        """Returns (snapshot, deltas): the last snapshot (None if there isn't one) and the deltas logged after it.
+        A torn record at the end of the log (crash mid-write) is dropped"""
+        snapshot = None
+        self.seq = 0
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+            self.seq = snapshot.pop('journal_seq', 0)
+        except FileNotFoundError:
+            pass
+
+        deltas = []
+        good_end = 0
+        try:
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            payload = data[offset + _HEADER.size : offset + _HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            seq, record = pickle.loads(payload)
+            if seq > self.seq: # older records are already in the snapshot
+                deltas.extend(record)
+                self.seq = seq
+            offset += _HEADER.size + length
+            good_end = offset
+
+        if good_end < len(data):
+            print(f"journal: dropping {len(data) - good_end} bytes of torn record")
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(good_end)
+
+        self.deltas_since_snapshot = len(deltas)
+        return snapshot, deltas
+
+    def append(self, *deltas):
+        """Logs deltas as one record. Returns True when it's time to write a snapshot"""
+        with metrics.timer('journal_write_seconds'):
+            self.seq += 1
+            payload = pickle.dumps((self.seq, list(deltas)), protocol=pickle.HIGHEST_PROTOCOL)
+            if self._file is None:
+                self._file = open(self.journal_path, 'ab')
+            self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._file.flush()
+            if JOURNAL_FSYNC:
+                os.fsync(self._file.fileno())
+        metrics.count('journal_write_bytes', _HEADER.size + len(payload))
+        self.deltas_since_snapshot += len(deltas)
+        return self.deltas_since_snapshot >= self.compact_every
+
+    def snapshot(self, state):
+        """Atomically replaces the snapshot with state and empties the log"""
+        tmp = self.snapshot_path + '.tmp'
+        with metrics.timer('snapshot_write_seconds'):
+            with open(tmp, 'wb') as f:
+                pickle.dump(dict(state, journal_seq=self.seq), f)
+                f.flush()
+                os.fsync(f.fileno())
+                metrics.gauge('snapshot_bytes', f.tell())
+            os.replace(tmp, self.snapshot_path)
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_path, 'wb')
+        self.deltas_since_snapshot = 0
+
+    def close(self):
+        """Closes the log file, it's reopened on the next append"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
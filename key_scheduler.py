@@ -0,0 +1,194 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import date
+from dotenv import load_dotenv
+import http_client
+import metrics
+
+load_dotenv()
+KEY_MAX_WAIT_SECS = float(os.getenv('KEY_MAX_WAIT_SECS', '5')) # wait this long for a key to free up before giving up
+KEY_BACKOFF_SECS = float(os.getenv('KEY_BACKOFF_SECS', '15')) # first cooldown after a 429, doubles each time
+KEY_MAX_BACKOFF_SECS = 3600
+SERVER_ERROR_RETRIES = 2
+
+# (requests per minute, requests per day) for each key, by provider
+LIMITS = {
+    'fmp'          : (int(os.getenv('FINANCIALMODELING_PER_MINUTE', '300')), int(os.getenv('FINANCIALMODELING_PER_DAY', '250'))),
+    'finnhub'      : (int(os.getenv('FINNHUB_PER_MINUTE', '60')), int(os.getenv('FINNHUB_PER_DAY', '1000000'))),
+    'alphavantage' : (int(os.getenv('ALPHAVANTAGE_PER_MINUTE', '5')), int(os.getenv('ALPHAVANTAGE_PER_DAY', '500')))
+}
+
+# query parameter the key goes in
+KEY_PARAMS = { 'fmp' : 'apikey', 'finnhub' : 'token', 'alphavantage' : 'apikey' }
+
+
+def header(headers, name):
+    """Case insensitive header lookup"""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def quota_notice(provider, response):
+    """Some providers put rate limit notices in the body (sometimes with a 200). Returns 'minute', 'day' or None"""
+    if provider == 'alphavantage' and ('"Note"' in response.text or '"Information"' in response.text):
+        return 'minute'
+    if provider == 'fmp' and 'Limit Reach' in response.text:
+        return 'day'
+    return None
+
+
+class KeyState():
+
+    def __init__(self, per_minute):
+        self.tokens = float(per_minute) # per-minute token bucket
+        self.refilled = time.monotonic()
+        self.day = date.today()
+        self.used_today = 0
+        self.cooldown_until = 0
+        self.failures = 0
+
+
+class KeyScheduler():
+    """Picks which API key to use for each request, tracking per-minute and daily quotas per key"""
+
+    def __init__(self, provider, keys, per_minute=None, per_day=None):
+        if isinstance(keys, str):
+            keys = [keys]
+        self.provider = provider
+        self.keys = [key for key in keys if key]
+        self.per_minute = per_minute or LIMITS[provider][0]
+        self.per_day = per_day or LIMITS[provider][1]
+        self.key_param = KEY_PARAMS[provider]
+        self._state = { key : KeyState(self.per_minute) for key in self.keys }
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns the available key with the most budget left and uses one request from it, or None if no key is available"""
+        with self._lock:
+            now = time.monotonic()
+            best = None
+            best_budget = 0
+            for key in self.keys:
+                budget = self._budget(self._state[key], now)
+                if budget > best_budget:
+                    best, best_budget = key, budget
+            if best is not None:
+                state = self._state[best]
+                state.tokens -= 1
+                state.used_today += 1
+            return best
+
+    def wait_time(self, reserve=0):
+        """Seconds until some key has budget again (inf if every key is out for the day).
+        With reserve, until some key has more than reserve requests left in its per-minute budget"""
+        with self._lock:
+            now = time.monotonic()
+            wait = float('inf')
+            for state in self._state.values():
+                if state.used_today >= self.per_day and state.day == date.today():
+                    continue
+                refill = max(0, reserve + 1 - state.tokens) * 60 / self.per_minute
+                wait = min(wait, max(state.cooldown_until - now, refill))
+            return max(wait, 0)
+
+    def report(self, key, response):
+        """Updates key's quota from a response. Returns True if the response is usable"""
+        with self._lock:
+            state = self._state[key]
+            code = response.status_code
+            notice = quota_notice(self.provider, response)
+            if code == 401 or notice == 'day':
+                state.used_today = self.per_day # out of daily quota (or a bad key), skip it until tomorrow
+                return False
+            if code == 403:
+                return False # a symbol or endpoint the plan doesn't cover, not the key's fault
+            if code == 429 or notice == 'minute':
+                retry_after = header(response.headers, 'Retry-After')
+                backoff = min(KEY_BACKOFF_SECS * 2 ** state.failures, KEY_MAX_BACKOFF_SECS)
+                state.cooldown_until = time.monotonic() + (float(retry_after) if retry_after and retry_after.isdigit() else backoff)
+                state.failures += 1
+                state.tokens = 0
+                return False
+            if code >= 500:
+                return False # server side trouble, not the key's fault
+
+            state.failures = 0
+            remaining = header(response.headers, 'X-RateLimit-Remaining')
+            if remaining is not None and remaining.isdigit():
+                state.tokens = min(state.tokens, float(remaining))
+            return True
+
+    def remaining_today(self):
+        """Requests left today across all keys"""
+        with self._lock:
+            now = time.monotonic()
+            for state in self._state.values():
+                self._budget(state, now) # rolls the day over
+            return sum(max(self.per_day - state.used_today, 0) for state in self._state.values())
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return { key[-4:] : self._budget(self._state[key], now) for key in self.keys }
+
+    async def get_async(self, url, params):
+        """GETs url with the best key, moving on to other keys when one is throttled. Uses the provider's pooled session"""
+        errors = 0
+        while True:
+            key = self.acquire()
+            if key is None:
+                wait = self.wait_time()
+                if wait > KEY_MAX_WAIT_SECS:
+                    raise Exception(f'Attempted to make request to URL {url} but there are no api keys with uses left.')
+                await asyncio.sleep(wait)
+                continue
+            try:
+                with metrics.timer('upstream_seconds', provider=self.provider):
+                    response = await http_client.get(self.provider, url, dict(params, **{ self.key_param : key }))
+            except Exception:
+                metrics.count('upstream_requests', provider=self.provider, status='error')
+                raise
+            metrics.count('upstream_requests', provider=self.provider, status=response.status_code)
+            if self.report(key, response):
+                return response
+            if response.status_code == 403:
+                raise Exception(f"Bad response code, response code {response.status_code}")
+            if response.status_code >= 500:
+                errors += 1
+                if errors > SERVER_ERROR_RETRIES:
+                    raise Exception(f"Bad response code, response code {response.status_code}")
+
+    def _budget(self, state, now):
+        """Requests key can make right now, caller must hold self._lock"""
+        today = date.today()
+        if state.day != today:
+            state.day = today
+            state.used_today = 0
+        state.tokens = min(self.per_minute, state.tokens + (now - state.refilled) * self.per_minute / 60)
+        state.refilled = now
+        if now < state.cooldown_until:
+            return 0
+        return min(int(state.tokens), self.per_day - state.used_today)
+
+
+ENV_KEYS = { 'fmp' : 'FINANCIALMODELING_KEYS', 'finnhub' : 'FINNHUB_KEY', 'alphavantage' : 'ALPHAVANTAGE_KEY' }
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(provider, keys=None):
+    """Shared scheduler for provider, so every user of the same keys sees the same quota.
+    keys defaults to the comma separated list in the provider's env variable"""
+    if keys is None:
+        keys = (os.getenv(ENV_KEYS[provider]) or '').split(',')
+    elif isinstance(keys, str):
+        keys = [keys]
+    keys = tuple(key.strip() for key in keys if key and key.strip())
+    with _schedulers_lock:
+        if (provider, keys) not in _schedulers:
+            _schedulers[(provider, keys)] = KeyScheduler(provider, keys)
+        return _schedulers[(provider, keys)]
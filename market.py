@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+import metrics
+import render
+from constituents import SP500
+from http_client import FINANCIALMODELING_URL
+from key_scheduler import get_scheduler
+from market_calendar import MARKET_CALENDAR
+
+load_dotenv()
+MARKET_REFRESH_SECS = int(os.getenv('MARKET_REFRESH_SECS', '120')) # how long a market snapshot is reused while the market is open
+MARKET_QUOTE_BATCH_SIZE = int(os.getenv('MARKET_QUOTE_BATCH_SIZE', '100')) # symbols per quote request, ~5 requests for the index
+MARKET_MOVERS = 5 # gainers and losers listed
+QUOTE_URL = FINANCIALMODELING_URL + 'quote/'
+
+
+async def fetch_quotes(symbols, batch_size=MARKET_QUOTE_BATCH_SIZE):
+    """symbol -> FMP quote row, requested batch_size symbols at a time, concurrently. Failed batches are left out"""
+    async def fetch(batch):
+        try:
+            data = (await get_scheduler('fmp').get_async(QUOTE_URL + ','.join(batch), {})).json()
+        except Exception as e:
+            print(f"market: quote batch failed: {e!r}")
+            return []
+        return data if isinstance(data, list) else []
+    batches = [symbols[i:i + batch_size] for i in range(0, len(symbols), batch_size)]
+    quotes = {}
+    for rows in await asyncio.gather(*(fetch(batch) for batch in batches)):
+        quotes.update((row['symbol'], row) for row in rows if row.get('price') and row.get('previousClose'))
+    return quotes
+
+def summarize(members, quotes, movers=MARKET_MOVERS):
+    """Index wide statistics from the constituents and their quotes. Changes are fractions, sectors are sorted
+    by market cap weighted change"""
+    quoted = [member for member in members if member['symbol'] in quotes]
+    symbols = np.array([member['symbol'] for member in quoted])
+    price = np.array([quotes[symbol]['price'] for symbol in symbols], dtype='f8')
+    prev_close = np.array([quotes[symbol]['previousClose'] for symbol in symbols], dtype='f8')
+    cap = np.array([quotes[symbol].get('marketCap') or 0 for symbol in symbols], dtype='f8')
+    change = price / prev_close - 1
+    sector_names, sector = np.unique([member['sector'] for member in quoted], return_inverse=True)
+
+    sector_cap = np.bincount(sector, weights=cap, minlength=len(sector_names))
+    sector_change = np.bincount(sector, weights=cap * change, minlength=len(sector_names)) / np.where(sector_cap > 0, sector_cap, 1)
+    sector_count = np.bincount(sector, minlength=len(sector_names))
+    sector_up = np.bincount(sector, weights=change > 0, minlength=len(sector_names))
+    order = np.argsort(-sector_change)
+    by_change = np.argsort(change)
+
+    return {
+        'constituents' : len(members),
+        'quoted' : len(symbols),
+        'cap_weighted_change' : float(cap @ change / cap.sum()) if cap.sum() else float(change.mean()),
+        'equal_weighted_change' : float(change.mean()),
+        'median_change' : float(np.median(change)),
+        'advancers' : int((change > 0).sum()),
+        'decliners' : int((change < 0).sum()),
+        'unchanged' : int((change == 0).sum()),
+        'sectors' : [(sector_names[i], float(sector_change[i]), int(sector_count[i]), int(sector_up[i])) for i in order],
+        'gainers' : [(symbols[i], float(price[i]), float(change[i])) for i in by_change[::-1][:movers]],
+        'losers' : [(symbols[i], float(price[i]), float(change[i])) for i in by_change[:movers]],
+        # treemap: one box per sector, holdings inside sized by market cap and colored by change
+        'treemap' : (list(sector_names) + symbols.tolist(), [''] * len(sector_names) + sector_names[sector].tolist(),
+                     [0.0] * len(sector_names) + cap.tolist(), (sector_change * 100).tolist() + (change * 100).tolist())
+    }
+
+
+class MarketSnapshot():
+    """S&P 500 wide quote statistics and heatmap, rebuilt at most every refresh seconds while the market is open
+    and kept from the close until the next open. Concurrent requests share one rebuild"""
+
+    def __init__(self, refresh=MARKET_REFRESH_SECS):
+        self.refresh = refresh
+        self._snapshot = None # (built at, stats, heatmap JPEG bytes)
+        self._building = None
+
+    def fresh(self, now=None):
+        if self._snapshot is None:
+            return False
+        now = now or time.time()
+        built = self._snapshot[0]
+        if MARKET_CALENDAR.is_open(now):
+            return now - built < self.refresh
+        return built >= MARKET_CALENDAR.last_close(now)
+
+    def invalidate(self):
+        self._snapshot = None
+
+    async def build(self):
+        with metrics.timer('market_snapshot_seconds'):
+            members = await SP500.get_async()
+            if not members:
+                return None
+            quotes = await fetch_quotes([member['symbol'] for member in members])
+            if not quotes:
+                return None
+            stats = summarize(members, quotes)
+            image = await render.render_treemap_async(f"S&P 500 {stats['cap_weighted_change'] * 100:+.2f}%", *stats['treemap'])
+            self._snapshot = (time.time(), stats, image)
+            return self._snapshot
+
+    async def get_async(self):
+        """(stats, image) of the latest snapshot, (None, None) if the constituents or quotes couldn't be loaded"""
+        if self.fresh():
+            metrics.count('market_snapshot', result='hit')
+            return self._snapshot[1:]
+        metrics.count('market_snapshot', result='miss')
+        if self._building is None or self._building.done():
+            self._building = asyncio.ensure_future(self.build())
+        snapshot = await asyncio.shield(self._building)
+        return (None, None) if snapshot is None else snapshot[1:]
+
+
+MARKET = MarketSnapshot()
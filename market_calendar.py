@@ -0,0 +1,133 @@
+from datetime import date, datetime, time, timedelta
+import pytz
+
+EASTERN = pytz.timezone('America/New_York')
+REGULAR_OPEN = time(9, 30)
+REGULAR_CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+
+
+def nth_weekday(year, month, weekday, n):
+    """n'th (1-based) weekday (0 = Monday) of the month, n = -1 for the last one"""
+    if n > 0:
+        d = date(year, month, 1)
+        d += timedelta(days=(weekday - d.weekday()) % 7)
+        return d + timedelta(weeks=n - 1)
+    d = date(year, month + 1, 1) - timedelta(days=1) if month < 12 else date(year, 12, 31)
+    return d - timedelta(days=(d.weekday() - weekday) % 7)
+
+def easter(year):
+    """Gregorian Easter Sunday (anonymous Gregorian algorithm)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+def observed(d):
+    """Saturday holidays are observed Friday, Sunday holidays Monday"""
+    if d.weekday() == 5:
+        return d - timedelta(days=1)
+    if d.weekday() == 6:
+        return d + timedelta(days=1)
+    return d
+
+def holidays(year):
+    """NYSE full-day closures for year"""
+    days = set()
+    new_years = date(year, 1, 1)
+    if new_years.weekday() != 5: # NYSE doesn't close the Friday before a Saturday New Year's Day
+        days.add(observed(new_years))
+    days.add(nth_weekday(year, 1, 0, 3)) # Martin Luther King Jr. Day
+    days.add(nth_weekday(year, 2, 0, 3)) # Washington's Birthday
+    days.add(easter(year) - timedelta(days=2)) # Good Friday
+    days.add(nth_weekday(year, 5, 0, -1)) # Memorial Day
+    if year >= 2022:
+        days.add(observed(date(year, 6, 19))) # Juneteenth
+    days.add(observed(date(year, 7, 4)))
+    days.add(nth_weekday(year, 9, 0, 1)) # Labor Day
+    days.add(nth_weekday(year, 11, 3, 4)) # Thanksgiving
+    days.add(observed(date(year, 12, 25)))
+    return days
+
+def early_closes(year, closed):
+    """Days the NYSE closes at 1pm: July 3rd, the day after Thanksgiving and Christmas Eve (when they are regular weekdays)"""
+    days = { date(year, 7, 3), nth_weekday(year, 11, 3, 4) + timedelta(days=1), date(year, 12, 24) }
+    return { d for d in days if d.weekday() < 5 and d not in closed }
+
+
+class MarketCalendar():
+
+    def __init__(self):
+        self._sessions = {} # date -> (open, close) as UTC timestamps, None for closed days. Filled a year at a time
+        self._years = set()
+        self.reconciled = None # date of the last reconcile() call
+
+    def session(self, d):
+        """(open, close) UTC timestamps of the trading session on d, or None if the market is closed that day"""
+        if d.year not in self._years:
+            self._build_year(d.year)
+        return self._sessions[d]
+
+    def is_open(self, now=None):
+        now = now if now is not None else datetime.now(pytz.utc).timestamp()
+        session = self.session(self.eastern_date(now))
+        return session is not None and session[0] <= now < session[1]
+
+    def last_close(self, now=None):
+        """UTC timestamp of the most recent session close at or before now"""
+        now = now if now is not None else datetime.now(pytz.utc).timestamp()
+        d = self.eastern_date(now)
+        while True:
+            session = self.session(d)
+            if session is not None and session[1] <= now:
+                return session[1]
+            d -= timedelta(days=1)
+
+    def reconcile(self, api_is_open, now=None):
+        """Corrects today's session if the exchange's own answer disagrees with the calendar (unscheduled closures).
+        Answers within 5 minutes of a scheduled open or close are ignored since the API may lag"""
+        now = now if now is not None else datetime.now(pytz.utc).timestamp()
+        d = self.eastern_date(now)
+        self.reconciled = d
+        session = self.session(d)
+        if session is not None and min(abs(now - session[0]), abs(now - session[1])) < 300:
+            return
+        if api_is_open != self.is_open(now):
+            print(f"market calendar: API says market is {'open' if api_is_open else 'closed'} on {d}, overriding calendar")
+            self._sessions[d] = self._make_session(d, REGULAR_CLOSE) if api_is_open else None
+
+    def needs_reconcile(self, now=None):
+        """True the first time it's called on each trading day once the market has opened"""
+        now = now if now is not None else datetime.now(pytz.utc).timestamp()
+        d = self.eastern_date(now)
+        return self.reconciled != d and self.is_open(now)
+
+    def eastern_date(self, timestamp):
+        return datetime.fromtimestamp(timestamp, EASTERN).date()
+
+    def _build_year(self, year):
+        closed = holidays(year)
+        early = early_closes(year, closed)
+        d = date(year, 1, 1)
+        while d.year == year:
+            if d.weekday() >= 5 or d in closed:
+                self._sessions[d] = None
+            else:
+                self._sessions[d] = self._make_session(d, EARLY_CLOSE if d in early else REGULAR_CLOSE)
+            d += timedelta(days=1)
+        self._years.add(year)
+
+    def _make_session(self, d, close):
+        market_open = EASTERN.localize(datetime.combine(d, REGULAR_OPEN)).timestamp()
+        market_close = EASTERN.localize(datetime.combine(d, close)).timestamp()
+        return (market_open, market_close)
+
+
+MARKET_CALENDAR = MarketCalendar()
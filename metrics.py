@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from dotenv import load_dotenv
+
+load_dotenv()
+STATS_ENABLED = (os.getenv('STATS_ENABLED', 'True') == 'True')
+METRICS_FILE = os.getenv('METRICS_FILE', 'metrics.prom') # Prometheus text format, written every METRICS_WRITE_SECS
+METRICS_WRITE_SECS = int(os.getenv('METRICS_WRITE_SECS', '60'))
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+_lock = threading.Lock()
+_histograms = {} # (name, labels) -> Histogram, labels is a sorted tuple of (label, value)
+_counters = {} # (name, labels) -> number
+_gauges = {} # (name, labels) -> number
+
+
+class Histogram():
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q'th quantile"""
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= target and n:
+                return bound
+        return BUCKETS[-1]
+
+
+def observe(name, value, **labels):
+    """Adds value (seconds) to histogram name"""
+    if not STATS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+def count(name, value=1, **labels):
+    if not STATS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def gauge(name, value, **labels):
+    if not STATS_ENABLED:
+        return
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+class _Timer():
+    """Context manager that observes the time spent inside it. Works in both sync code and coroutines"""
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _NoTimer():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+def timer(name, **labels):
+    return _Timer(name, labels) if STATS_ENABLED else _NO_TIMER
+
+
+def format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+def summary():
+    """Human readable lines for `stonks stats`"""
+    lines = []
+    with _lock:
+        for (name, labels), histogram in sorted(_histograms.items()):
+            lines.append(f"{name}{format_labels(labels)}: n={histogram.count} avg={histogram.sum / histogram.count * 1000:.1f}ms "
+                         f"p50<={histogram.quantile(0.5) * 1000:g}ms p99<={histogram.quantile(0.99) * 1000:g}ms")
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append(f"{name}{format_labels(labels)}: {value:g}")
+        for (name, labels), value in sorted(_gauges.items()):
+            lines.append(f"{name}{format_labels(labels)}: {value:g}")
+    return lines
+
+def prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        typed = set()
+        for (name, labels), histogram in sorted(_histograms.items()):
+            if name not in typed:
+                lines.append(f'# TYPE stonks_{name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(BUCKETS, histogram.counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'stonks_{name}_bucket{format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'stonks_{name}_sum{format_labels(labels)} {histogram.sum}')
+            lines.append(f'stonks_{name}_count{format_labels(labels)} {histogram.count}')
+        for kind, values in (('counter', _counters), ('gauge', _gauges)):
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE stonks_{name} {kind}')
+                    typed.add(name)
+                lines.append(f'stonks_{name}{format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(path=METRICS_FILE):
+    if not STATS_ENABLED:
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(prometheus())
+    os.replace(tmp, path)
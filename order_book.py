@@ -0,0 +1,66 @@
+from threshold_index import ThresholdIndex
+
+ORDER_TYPES = ('limit', 'stop')
+
+
+class RestingOrder():
+
+    def __init__(self, order_id, side, order_type, ticker, shares, trigger):
+        self.id = order_id
+        self.side = side # 'BUY' or 'SELL'
+        self.type = order_type # 'limit' or 'stop'
+        self.ticker = ticker
+        self.shares = shares
+        self.trigger = trigger
+
+    def thresholds(self):
+        """(above, below) trigger for the ThresholdIndex. Buy limits and sell stops fill at or below the trigger,
+        sell limits and buy stops at or above it"""
+        if (self.side == 'BUY') == (self.type == 'limit'):
+            return None, self.trigger
+        return self.trigger, None
+
+    def as_tuple(self):
+        return (self.id, self.side, self.type, self.ticker, self.shares, self.trigger)
+
+    def describe(self):
+        return f"#{self.id} {self.side} {self.shares} {self.ticker} {self.type} ${self.trigger:,.2f}"
+
+
+class OrderBook():
+    """Limit and stop orders waiting for their trigger price, indexed per ticker by trigger so each price
+    check only touches the crossed orders"""
+
+    def __init__(self):
+        self.orders = {} # id -> RestingOrder, in placement order
+        self._index = ThresholdIndex()
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __getstate__(self):
+        return { 'orders' : [order.as_tuple() for order in self.orders.values()] }
+
+    def __setstate__(self, state):
+        self.__init__()
+        for order in state['orders']:
+            self.add(RestingOrder(*order))
+
+    def add(self, order):
+        self.orders[order.id] = order
+        self._index.add(order.ticker, order.id, *order.thresholds())
+
+    def remove(self, order_id):
+        """Removes and returns an order, None if there is no such order"""
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            self._index.remove(order.ticker, order.id, *order.thresholds())
+        return order
+
+    def tickers(self):
+        return self._index.symbols()
+
+    def crossed(self, prices):
+        """Orders whose trigger prices (a dict of ticker -> price) have crossed, oldest first. They stay in the book"""
+        crossed = [self.orders[order_id] for ticker, price in prices.items() for order_id in self._index.crossed(ticker, price)]
+        return sorted(crossed, key=lambda order: order.id)
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import re
+import time
+from collections import deque
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+DISCORD_MAX_LEN = 2000
+FENCE = '```'
+PROFILE_EDIT_MIN_SECS = int(os.getenv('PROFILE_EDIT_MIN_SECS', '600')) # channel renames and avatar changes are rate limited hard by Discord
+
+
+def open_fence(text, fence=None):
+    """The opening fence (e.g. '```py') of the code block still open at the end of text, None if there isn't one.
+    fence is the block text starts in"""
+    for match in re.finditer(FENCE + r'[\w+-]*', text):
+        fence = None if fence else match.group(0)
+    return fence
+
+def split_text(text, max_len=DISCORD_MAX_LEN):
+    """Splits text into pieces of at most max_len, between lines where possible. A code block split across pieces
+    is closed at the end of one and reopened at the start of the next"""
+    pieces = []
+    fence = None
+    while True:
+        prefix = fence + '\n' if fence else ''
+        if len(prefix) + len(text) <= max_len:
+            pieces.append(prefix + text)
+            return pieces
+        room = max(max_len - len(prefix) - len(FENCE) - 1, 1) # so the block can be closed
+        cut = text.rfind('\n', 0, room)
+        if cut <= 0 or re.fullmatch(FENCE + r'[\w+-]*', text[:cut].strip()): # not just the opening of a block
+            cut = room
+        piece = text[:cut]
+        fence = open_fence(piece, fence)
+        pieces.append(prefix + piece + ('\n' + FENCE if fence else ''))
+        text = text[cut:].lstrip('\n')
+
+
+class Outbox():
+    """Per channel send queue. Sends return immediately; text queued behind an in-flight send is
+    coalesced into as few messages as fit in Discord's length limit. Messages with files go out on their own,
+    in order"""
+
+    def __init__(self, max_len=DISCORD_MAX_LEN, edit_min_secs=PROFILE_EDIT_MIN_SECS):
+        self.max_len = max_len
+        self.edit_min_secs = edit_min_secs
+        self._queues = {} # channel id -> deque of (content, files)
+        self._workers = {} # channel id -> task draining the queue
+        self._last_edit = {} # (kind, target id) -> monotonic time of the last edit
+
+    async def send(self, channel, content=None, file=None, files=None):
+        files = [file] if file is not None else files
+        queue = self._queues.setdefault(channel.id, deque())
+        queue.append((content, files))
+        metrics.gauge('outbox_depth', len(queue), channel=channel.id)
+        worker = self._workers.get(channel.id)
+        if worker is None or worker.done():
+            self._workers[channel.id] = asyncio.ensure_future(self._drain(channel))
+
+    async def flush(self, channel):
+        """Waits until everything queued for channel has been sent"""
+        worker = self._workers.get(channel.id)
+        if worker is not None:
+            await asyncio.shield(worker)
+
+    def next_message(self, queue):
+        """Pops the next message to send off queue, merging consecutive text-only entries"""
+        content, files = queue.popleft()
+        if files or content is None:
+            return content, files
+        pieces = split_text(content, self.max_len)
+        if len(pieces) > 1:
+            for piece in reversed(pieces[1:]):
+                queue.appendleft((piece, None))
+            return pieces[0], None
+        merged = 1
+        while queue and not queue[0][1] and queue[0][0] is not None and len(content) + 1 + len(queue[0][0]) <= self.max_len:
+            content += '\n' + queue.popleft()[0]
+            merged += 1
+        if merged > 1:
+            metrics.count('outbox_coalesced', merged - 1)
+        return content, None
+
+    async def _drain(self, channel):
+        queue = self._queues[channel.id]
+        while queue:
+            content, files = self.next_message(queue)
+            metrics.gauge('outbox_depth', len(queue), channel=channel.id)
+            try:
+                with metrics.timer('discord_send_seconds'):
+                    await channel.send(content, files=files)
+                metrics.count('outbox_sent')
+            except Exception as e:
+                print(f"outbox: send to {channel.id} failed: {e!r}")
+
+    def edit_allowed(self, kind, target_id):
+        """True (and starts the cooldown) if target hasn't had an edit of this kind in the last edit_min_secs"""
+        now = time.monotonic()
+        last = self._last_edit.get((kind, target_id))
+        if last is not None and now - last < self.edit_min_secs:
+            metrics.count('profile_edits_throttled', kind=kind)
+            return False
+        self._last_edit[(kind, target_id)] = now
+        metrics.count('profile_edits', kind=kind)
+        return True
+
+    async def rename_channel(self, channel, name):
+        """Renames channel unless it was renamed recently. Returns True if it was renamed"""
+        if channel.name == name or not self.edit_allowed('channel', channel.id):
+            return False
+        await channel.edit(name=name)
+        return True
+
+    async def change_avatar(self, user, avatar):
+        """Changes the bot's avatar unless it was changed recently. Returns True if it was changed"""
+        if not self.edit_allowed('avatar', user.id):
+            return False
+        await user.edit(avatar=avatar)
+        return True
+
+
+OUTBOX = Outbox()
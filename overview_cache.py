@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from dotenv import load_dotenv
+from http_client import ALPHAVANTAGE_URL
+from key_scheduler import get_scheduler
+import metrics
+
+load_dotenv()
+OVERVIEW_DB = os.getenv('OVERVIEW_DB', 'overviews.sqlite')
+OVERVIEW_TTL_SECS = int(os.getenv('OVERVIEW_TTL_DAYS', '30')) * 24 * 3600 # company descriptions hardly ever change
+OVERVIEW_MISSING_TTL_SECS = 24 * 3600 # unknown symbols are asked about again after a day
+OVERVIEW_PREFETCH_RESERVE = int(os.getenv('OVERVIEW_PREFETCH_RESERVE', '100')) # daily AlphaVantage requests prefetching leaves for users
+OVERVIEW_PREFETCH_MINUTE_RESERVE = int(os.getenv('OVERVIEW_PREFETCH_MINUTE_RESERVE', '1')) # and per-minute requests, so commands don't wait on it
+
+
+def overview_params(symbol):
+    return { 'function' : 'OVERVIEW', 'symbol' : symbol }
+
+def found(info):
+    return bool(info) and 'Description' in info
+
+
+class OverviewCache():
+    """AlphaVantage OVERVIEW responses in SQLite. Stale entries are served while they are refreshed in the background"""
+
+    def __init__(self, path=OVERVIEW_DB, ttl=OVERVIEW_TTL_SECS):
+        self.ttl = ttl
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS overviews (symbol TEXT PRIMARY KEY, fetched REAL NOT NULL, data TEXT NOT NULL)')
+        self._db.commit()
+        self._refreshing = {} # symbol -> task, so each symbol is fetched once at a time
+
+    def lookup(self, symbol):
+        """(info, fresh) for symbol, or (None, False) if it was never fetched"""
+        row = self._db.execute('SELECT fetched, data FROM overviews WHERE symbol = ?', (symbol,)).fetchone()
+        if row is None:
+            return None, False
+        fetched, data = row
+        info = json.loads(data)
+        return info, time.time() - fetched < (self.ttl if found(info) else OVERVIEW_MISSING_TTL_SECS)
+
+    def put(self, symbol, info):
+        self._db.execute('INSERT OR REPLACE INTO overviews VALUES (?, ?, ?)', (symbol, time.time(), json.dumps(info)))
+        self._db.commit()
+
+    def stale_symbols(self, symbols):
+        """The symbols that are missing or past their TTL"""
+        return [symbol for symbol in symbols if not self.lookup(symbol)[1]]
+
+    async def fetch(self, symbol):
+        response = await get_scheduler('alphavantage').get_async(ALPHAVANTAGE_URL, overview_params(symbol))
+        info = response.json()
+        if found(info) or 'Error Message' in info or info == {}:
+            self.put(symbol, info) # rate limit notes and other errors aren't cached
+        return info
+
+    def refresh(self, symbol):
+        task = self._refreshing.get(symbol)
+        if task is None or task.done():
+            task = self._refreshing[symbol] = asyncio.ensure_future(self.fetch(symbol))
+        return task
+
+    async def get_async(self, symbol):
+        """Overview for symbol, from the cache when there is an entry (refreshing it in the background if stale)"""
+        info, fresh = self.lookup(symbol)
+        if info is not None:
+            metrics.count('overview_cache', result='hit' if fresh else 'stale')
+            if not fresh:
+                self.refresh(symbol).add_done_callback(lambda task: task.cancelled() or task.exception()) # failures are retried next time
+            return info
+        metrics.count('overview_cache', result='miss')
+        return await self.refresh(symbol)
+
+    async def prefetch(self, symbols, limit):
+        """Fetches up to limit missing or stale overviews, one at a time, stopping early to keep
+        OVERVIEW_PREFETCH_RESERVE of the day's AlphaVantage quota. Each fetch waits until a key has more than
+        OVERVIEW_PREFETCH_MINUTE_RESERVE requests left this minute. Returns how many were fetched"""
+        scheduler = get_scheduler('alphavantage')
+        fetched = 0
+        for symbol in self.stale_symbols(symbols)[:limit]:
+            if scheduler.remaining_today() <= OVERVIEW_PREFETCH_RESERVE:
+                break
+            wait = scheduler.wait_time(OVERVIEW_PREFETCH_MINUTE_RESERVE)
+            while 0 < wait < float('inf'): # a command may have taken the token while we slept, so check again
+                await asyncio.sleep(wait)
+                wait = scheduler.wait_time(OVERVIEW_PREFETCH_MINUTE_RESERVE)
+            if wait == float('inf'):
+                break
+            try:
+                await self.refresh(symbol)
+            except Exception as e:
+                print(f"overview prefetch: {symbol}: {e!r}")
+                break
+            fetched += 1
+        metrics.count('overview_prefetched', fetched)
+        return fetched
+
+    def stats(self):
+        count, = self._db.execute('SELECT COUNT(*) FROM overviews').fetchone()
+        return { 'entries' : count }
+
+
+OVERVIEW_CACHE = OverviewCache()
@@ -0,0 +1,116 @@
+import itertools
+import os
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+from dotenv import load_dotenv
+from history_store import BAR_DTYPE
+
+load_dotenv()
+INTRADAY_SAMPLES = int(os.getenv('INTRADAY_SAMPLES', '20000')) # most recent intraday values kept, about a week of minute ticks
+
+SAMPLE_DTYPE = np.dtype([('time', 'f8'), ('value', 'f8')])
+SPAN_DAYS = { 'W' : 7, 'M' : 30, 'Y' : 365 } # 'F' is everything
+
+_versions = itertools.count(1) # shared by every history, so a version is never reused in this process
+
+
+class PortfolioHistory():
+    """Portfolio value over time: daily OHLC bars sorted by date, plus a fixed size ring of intraday samples.
+    Recording a sample updates today's bar in place, so per-tick cost and intraday memory don't grow with age"""
+
+    def __init__(self, intraday_samples=INTRADAY_SAMPLES):
+        self._bars = np.empty(64, dtype=BAR_DTYPE) # grows by doubling, the first n rows are used
+        self.n = 0
+        self._samples = np.zeros(intraday_samples, dtype=SAMPLE_DTYPE)
+        self._next_sample = 0 # ring position of the next sample
+        self.n_samples = 0
+        self.version = next(_versions) # changed on every change, for memoizing things computed from the history
+
+    @classmethod
+    def from_dict(cls, history):
+        """Converts the old { '%m/%d/%Y' : { 'open', 'high', 'low', 'close' } } format"""
+        portfolio_history = cls()
+        for d in sorted(history, key=lambda d: datetime.strptime(d, "%m/%d/%Y")):
+            bar = history[d]
+            portfolio_history.set_bar(datetime.strptime(d, "%m/%d/%Y").toordinal(), (bar['open'], bar['high'], bar['low'], bar['close']))
+        return portfolio_history
+
+    def __len__(self):
+        return self.n
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_bars'] = self.bars # don't pickle the spare capacity
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.version = next(_versions) # a reloaded history mustn't match memos of the one it was saved from
+
+    def daily_copy(self):
+        """Copy of the daily bars (without the intraday samples), for read snapshots"""
+        history = PortfolioHistory(intraday_samples=1)
+        history._bars = self.bars.copy()
+        history.n = self.n
+        history.version = self.version
+        return history
+
+    @property
+    def bars(self):
+        return self._bars[:self.n]
+
+    def last_bar(self):
+        return self._bars[self.n - 1] if self.n else None
+
+    def set_bar(self, day, bar):
+        """Sets the (open, high, low, close) bar for ordinal day, appending it if day is newer than the last bar"""
+        self.version = next(_versions)
+        if self.n and self._bars[self.n - 1]['date'] == day:
+            self._bars[self.n - 1] = (day, *bar)
+            return
+        if self.n and self._bars[self.n - 1]['date'] > day: # out of order, only happens converting old data
+            idx = np.searchsorted(self.bars['date'], day)
+            if idx < self.n and self._bars[idx]['date'] == day:
+                self._bars[idx] = (day, *bar)
+                return
+            self._bars = np.insert(self.bars, idx, (day, *bar))
+            self.n += 1
+            return
+        if self.n == len(self._bars):
+            self._bars = np.resize(self._bars, max(64, 2 * len(self._bars))) # an unpickled history has no spare room
+        self._bars[self.n] = (day, *bar)
+        self.n += 1
+
+    def add_sample(self, timestamp, value):
+        self._samples[self._next_sample] = (timestamp, value)
+        self._next_sample = (self._next_sample + 1) % len(self._samples)
+        self.n_samples = min(self.n_samples + 1, len(self._samples))
+
+    def record(self, value, timestamp=None):
+        """Adds an intraday sample and rolls it into that day's bar. Returns (day, bar) for the journal"""
+        timestamp = time.time() if timestamp is None else timestamp
+        day = date.fromtimestamp(timestamp).toordinal()
+        last = self.last_bar()
+        if last is not None and last['date'] == day:
+            bar = (float(last['open']), max(float(last['high']), value), min(float(last['low']), value), value)
+        else:
+            bar = (value, value, value, value)
+        self.add_sample(timestamp, value)
+        self.set_bar(day, bar)
+        return day, bar
+
+    def prev_close(self, today=None):
+        """Close of the last bar before today, or None if there isn't one"""
+        today = (today or date.today()).toordinal()
+        idx = self.n - 1
+        if idx >= 0 and self._bars[idx]['date'] >= today:
+            idx -= 1
+        return float(self._bars[idx]['close']) if idx >= 0 else None
+
+    def window(self, time_span, today=None):
+        """Bars in the last W/M/Y of days (F for all), found by binary search on the date column"""
+        if time_span == 'F':
+            return self.bars
+        start = (today or date.today()) - timedelta(days=SPAN_DAYS.get(time_span, 30))
+        return self.bars[np.searchsorted(self.bars['date'], start.toordinal(), side='right'):]
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+from datetime import date
+import aiohttp
+from yarl import URL
+from dotenv import load_dotenv
+from key_scheduler import get_scheduler
+
+load_dotenv()
+PRICE_STREAM_ENABLED = (os.getenv('PRICE_STREAM_ENABLED', 'False') == 'True')
+FINNHUB_WS_URL = os.getenv('FINNHUB_WS_URL', 'wss://ws.finnhub.io')
+STREAM_DEBOUNCE_SECS = float(os.getenv('STREAM_DEBOUNCE_SECS', '5')) # wait this long after a trade to batch up changes
+STREAM_MAX_BACKOFF_SECS = 60
+
+
+class PriceBook():
+    """Last price and day open/high/low for each symbol, fed by trades from the stream"""
+
+    def __init__(self):
+        self._quotes = {} # symbol -> { 'c', 'o', 'h', 'l', 'pc', 'day' }
+
+    def seed(self, symbol, quote):
+        """Starts symbol off from a REST quote (needs 'c', and 'o', 'h', 'l', 'pc' for full quotes)"""
+        book_quote = self._quotes.get(symbol)
+        if book_quote is not None and book_quote['day'] == date.today() and book_quote.get('pc') is not None:
+            return
+        self._quotes[symbol] = { 'c' : quote['c'], 'o' : quote.get('o', quote['c']), 'h' : quote.get('h', quote['c']),
+                                 'l' : quote.get('l', quote['c']), 'pc' : quote.get('pc'), 'day' : date.today() }
+
+    def trade(self, symbol, price):
+        """Applies a trade, returns True if the last price moved"""
+        quote = self._quotes.get(symbol)
+        today = date.today()
+        if quote is None:
+            self._quotes[symbol] = { 'c' : price, 'o' : price, 'h' : price, 'l' : price, 'pc' : None, 'day' : today }
+            return True
+        if quote['day'] != today: # first trade of a new day
+            quote.update({ 'pc' : quote['c'], 'o' : price, 'h' : price, 'l' : price, 'day' : today })
+        moved = price != quote['c']
+        quote['c'] = price
+        quote['h'] = max(quote['h'], price)
+        quote['l'] = min(quote['l'], price)
+        return moved
+
+    def price(self, symbol):
+        quote = self._quotes.get(symbol)
+        return None if quote is None else quote['c']
+
+    def quote(self, symbol):
+        """Copy of symbol's quote in the same format as a Finnhub REST quote, None unless the previous close is known"""
+        quote = self._quotes.get(symbol)
+        if quote is None or quote['pc'] is None:
+            return None
+        return { key : quote[key] for key in ('c', 'o', 'h', 'l', 'pc') }
+
+
+class PriceStream():
+    """Finnhub trade websocket feeding a PriceBook, reconnects (and resubscribes) with backoff"""
+
+    def __init__(self, book, url=FINNHUB_WS_URL, token=None):
+        self.book = book
+        self.url = url
+        self.token = token
+        self.symbols = set()
+        self.connected = False
+        self._ws = None
+        self._changed = None
+        self._task = None
+
+    def started(self):
+        return self._task is not None
+
+    def start(self):
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def has(self, symbol):
+        """True if symbol is subscribed and the book can be trusted for it"""
+        return self.connected and symbol in self.symbols
+
+    async def set_symbols(self, symbols):
+        """Subscribes to exactly these symbols"""
+        symbols = set(symbols)
+        added = symbols - self.symbols
+        removed = self.symbols - symbols
+        self.symbols = symbols
+        if self._ws is not None and not self._ws.closed:
+            for symbol in removed:
+                await self._ws.send_str(json.dumps({ 'type' : 'unsubscribe', 'symbol' : symbol }))
+            for symbol in added:
+                await self._ws.send_str(json.dumps({ 'type' : 'subscribe', 'symbol' : symbol }))
+
+    async def wait_for_change(self, debounce=STREAM_DEBOUNCE_SECS):
+        """Returns once the book has changed, after waiting debounce seconds for more trades to come in"""
+        await self._changed.wait()
+        await asyncio.sleep(debounce)
+        self._changed.clear()
+
+    def handle(self, data):
+        if data.get('type') != 'trade':
+            return # pings
+        moved = False
+        for trade in data.get('data', []):
+            moved = self.book.trade(trade['s'], trade['p']) or moved
+        if moved:
+            self._changed.set()
+
+    async def run(self):
+        token = self.token or (get_scheduler('finnhub').keys or [''])[0]
+        url = URL(self.url).update_query(token=token) # ws_connect has no params argument on aiohttp 3.7
+        backoff = 1
+        # no total timeout on this session, the socket stays open indefinitely
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.ws_connect(url, heartbeat=30) as ws:
+                        self._ws = ws
+                        self.connected = True
+                        backoff = 1
+                        print("price stream: connected")
+                        for symbol in self.symbols:
+                            await ws.send_str(json.dumps({ 'type' : 'subscribe', 'symbol' : symbol }))
+                        async for msg in ws:
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                self.handle(json.loads(msg.data))
+                            elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                                break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"price stream: {e!r}")
+                finally:
+                    self.connected = False
+                    self._ws = None
+                print(f"price stream: disconnected, reconnecting in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, STREAM_MAX_BACKOFF_SECS)
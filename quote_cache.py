@@ -0,0 +1,124 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+load_dotenv()
+QUOTE_CACHE_TTL = float(os.getenv('QUOTE_CACHE_TTL', '15'))
+QUOTE_CACHE_SIZE = int(os.getenv('QUOTE_CACHE_SIZE', '2048'))
+
+_MISSING = object()
+
+
+class QuoteCache():
+
+    def __init__(self, ttl=QUOTE_CACHE_TTL, maxsize=QUOTE_CACHE_SIZE):
+        """ttl in seconds, maxsize is the max number of entries kept (least recently used are dropped first)"""
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0 # misses that waited on another caller's fetch instead of fetching
+
+        self._entries = OrderedDict() # key -> (expiry time, value)
+        self._inflight = {} # key -> Future for the fetch currently running
+        self._lock = threading.Lock()
+
+    async def get_async(self, key, fetch):
+        """Returns the cached value for key, or awaits fetch() (with no arguments) to get and cache it"""
+        async def fetch_many(keys):
+            return { key : await fetch() }
+        result = await self.get_many_async([key], fetch_many)
+        return result.get(key)
+
+    async def get_many_async(self, keys, fetch_many):
+        """Returns dictionary of key -> value for the given keys. fetch_many is a coroutine function that takes a list of
+        keys that are not cached and not already being fetched, and returns a dictionary of the ones it found.
+        Keys that could not be found are left out of the result and are not cached"""
+        result, waiting, owned = self._claim(keys)
+
+        if owned:
+            try:
+                fetched = await fetch_many(owned)
+            except BaseException as e:
+                self._fail(owned, e)
+                raise
+            self._fill(owned, fetched, result)
+
+        for key, future in waiting.items():
+            value = await asyncio.wrap_future(future)
+            if value is not _MISSING:
+                result[key] = value
+
+        return result
+
+    def invalidate(self, key=None):
+        """Drops key from the cache, or everything if no key is given"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced
+            }
+
+    def _claim(self, keys):
+        """Splits keys into cached values, futures for keys another caller is fetching, and keys this caller must fetch"""
+        result = {}
+        waiting = {}
+        owned = []
+
+        now = time.monotonic()
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    result[key] = entry[1]
+                    self.hits += 1
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                    self.coalesced += 1
+                else:
+                    self._inflight[key] = Future()
+                    owned.append(key)
+                    self.misses += 1
+
+        return result, waiting, owned
+
+    def _fill(self, owned, fetched, result):
+        with self._lock:
+            expiry = time.monotonic() + self.ttl
+            for key in owned:
+                value = fetched.get(key, _MISSING)
+                if value is not _MISSING:
+                    self._store(key, value, expiry)
+                    result[key] = value
+                self._inflight.pop(key).set_result(value)
+
+    def _fail(self, owned, e):
+        with self._lock:
+            for key in owned:
+                self._inflight.pop(key).set_exception(e)
+
+    def _store(self, key, value, expiry):
+        """Caller must hold self._lock"""
+        self._entries[key] = (expiry, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+# shared by the bot and the broker, keys are (source, SYMBOL)
+QUOTE_CACHE = QuoteCache()
@@ -0,0 +1,85 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '2'))
+
+_pool = None
+
+
+def _start_kaleido():
+    """Pool initializer, renders a blank figure so kaleido's chromium is already running for the first real chart"""
+    import plotly.graph_objs as go
+    go.Figure().to_image(format='jpg', width=10, height=10)
+
+def _ready():
+    return os.getpid()
+
+def render_candlestick(title, y_title, dates, open_prices, high_prices, low_prices, close_prices):
+    """Draws a candlestick chart, returns it as JPEG bytes. Runs in the calling process"""
+    import plotly.graph_objs as go
+
+    candlestick_data = [go.Candlestick(x=dates, open=open_prices, high=high_prices, low=low_prices, close=close_prices)]
+
+    layout = {'title' : title,
+              'xaxis' : go.layout.XAxis(title=go.layout.xaxis.Title( text="Date")),
+              'yaxis' : go.layout.YAxis(title=go.layout.yaxis.Title( text=y_title))}
+
+    fig = go.Figure(data=candlestick_data, layout=layout)
+    fig.update_layout(xaxis_rangeslider_visible=False)
+
+    return fig.to_image(format='jpg')
+
+def render_treemap(title, labels, parents, values, changes, limit=3.0):
+    """Draws a heatmap of boxes sized by values and colored by changes (percent, full color at +-limit), nested by parents.
+    Returns it as JPEG bytes. Runs in the calling process"""
+    import plotly.graph_objs as go
+
+    treemap = go.Treemap(labels=labels, parents=parents, values=values, branchvalues='remainder',
+                         marker=dict(colors=changes, colorscale='RdYlGn', cmin=-limit, cmax=limit),
+                         texttemplate='%{label}<br>%{color:+.2f}%')
+
+    fig = go.Figure(data=[treemap], layout={'title' : title})
+    fig.update_layout(margin=dict(l=5, r=5, t=40, b=5))
+
+    return fig.to_image(format='jpg', width=1400, height=900)
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=_start_kaleido)
+    return _pool
+
+def warm():
+    """Starts the render workers (and their kaleido processes) in the background"""
+    pool = get_pool()
+    for i in range(RENDER_WORKERS):
+        pool.submit(_ready)
+
+async def run(func, *args):
+    """Runs func(*args) in the render pool, restarting the pool once if a worker died"""
+    global _pool
+    loop = asyncio.get_running_loop()
+    with metrics.timer('chart_render_seconds'):
+        pool = get_pool()
+        try:
+            return await loop.run_in_executor(pool, func, *args)
+        except BrokenProcessPool:
+            # concurrent renders fail together, only the first replaces the pool (the others retry on its new one)
+            if _pool is pool:
+                print("render pool broken, restarting")
+                _pool = None
+                pool.shutdown(wait=False)
+            return await loop.run_in_executor(get_pool(), func, *args)
+
+async def render_candlestick_async(*args):
+    """Async version of render_candlestick, renders in a worker process"""
+    return await run(render_candlestick, *args)
+
+async def render_treemap_async(*args):
+    """Async version of render_treemap, renders in a worker process"""
+    return await run(render_treemap, *args)
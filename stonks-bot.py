@@ -1,41 +1,134 @@
+import time
+STARTED = time.perf_counter() # startup timings are measured from here
+
 import discord
 from discord.ext.tasks import loop
 import os
 from dotenv import load_dotenv
-import requests
-from datetime import datetime
-from charts import save_chart
-from broker import Broker
+import asyncio
+from datetime import datetime, date
+from charts import render_chart_async
+import render
+import io
+from broker import Broker, describe_queued
+from accounts import AccountStore, STARTING_BALANCE
+from broker_actor import BrokerActor
+from order_book import ORDER_TYPES
+from quote_cache import QUOTE_CACHE
+from market_calendar import MARKET_CALENDAR
+from chart_cache import CHART_CACHE
+from outbox import OUTBOX, DISCORD_MAX_LEN
+from constituents import SP500
+from price_stream import PriceBook, PriceStream, PRICE_STREAM_ENABLED
+import metrics
+from history_store import HISTORY_STORE
+from http_client import FINNHUB_URL
+from key_scheduler import get_scheduler
 import textwrap
+from functools import lru_cache
+
+startup_times = {} # phase -> seconds, also exported as the startup_seconds gauge
+first_response_seen = False
+
+def startup_phase(phase, since):
+    """Records how long a startup phase took, returns now for timing the next one"""
+    now = time.perf_counter()
+    startup_times[phase] = now - since
+    metrics.gauge('startup_seconds', now - since, phase=phase)
+    print(f"startup: {phase} took {now - since:.3f}s")
+    return now
+
+phase_start = startup_phase('imports', STARTED)
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 GUILD = os.getenv('DISCORD_GUILD')
-FINNHUB_KEY = os.getenv('FINNHUB_KEY')
-ALPHAVANTAGE_KEY = os.getenv('ALPHAVANTAGE_KEY')
 FINANCIALMODELING_KEYS = os.getenv('FINANCIALMODELING_KEYS').split(',')
 
 STONKS_EMOJI = os.getenv('STONKS_EMOJI')
 UNSTONKS_EMOJI = os.getenv('UNSTONKS_EMOJI')
 STATUS_UPDATE_SECS = int(os.getenv('STATUS_UPDATE_SECS'))
 INFO_WIDTH = int(os.getenv('INFO_WIDTH'))
+STATUS_HYSTERESIS_PCT = float(os.getenv('STATUS_HYSTERESIS_PCT', '0.1')) # only flip stonks/unstonks once this far past the previous close
+OVERVIEW_PREFETCH = (os.getenv('OVERVIEW_PREFETCH', 'True') == 'True') # warm the S&P 500 company overviews while the market is closed
+OVERVIEW_PREFETCH_PER_RUN = int(os.getenv('OVERVIEW_PREFETCH_PER_RUN', '50'))
+FANOUT_CONCURRENCY = int(os.getenv('FANOUT_CONCURRENCY', '16')) # upstream requests in flight per multi-ticker command
 
 TEST_MODE = (os.getenv('TEST_MODE') == 'True')
 
 status_ticker = os.getenv('STATUS_TICKER')
-pfp_panik = bytearray(open("pfp/panik.jpg", 'rb').read())
-pfp_kalm = bytearray(open("pfp/kalm.jpg", 'rb').read())
-
+status_closed_shown = None # (status_ticker, close timestamp) once the status has been shown after a close
+status_pfp = None # "stonks" or "unstonks", whichever avatar was last set
+daily_closes_recorded = None # close timestamp of the last session every account's value was recorded for
+status_account_key = None # account "stonks status PORTFOLIO" tracks, None for the shared account
+LEADERBOARD_SIZE = 10
+
+@lru_cache(maxsize=None)
+def avatar(name):
+    """Avatar image bytes, "kalm" or "panik", read on first use"""
+    with open(f"pfp/{name}.jpg", 'rb') as f:
+        return f.read()
+
+
+COMMANDS = { "status", "chart", "info", "buy", "sell", "portfolio", "help", "queue", "stats", "analytics", "backtest", "alert", "leaderboard", "market" }
+
+# built by setup(), not on import: render and backtest workers started with spawn (Windows) re-run this file
+client = None
+broker = None # the shared account, also used for quotes and market hours
+shared_account = None # changes to the shared account go through here
+accounts = None
+OVERVIEW_CACHE = None
+ALERTS = None
+ALERT_KINDS = None
+
+async def account_of(message):
+    """The paper trading account (a BrokerActor) of a message's author"""
+    return await accounts.get(message.author.id, message.guild.id if message.guild else None)
+
+async def status_account():
+    """The account shown by "stonks status PORTFOLIO": whoever set it last, or the shared account"""
+    account = await accounts.by_key(status_account_key) if status_account_key else None
+    return account or shared_account
+
+price_book = PriceBook()
+price_stream = PriceStream(price_book) if PRICE_STREAM_ENABLED else None
+status_lock = asyncio.Lock()
+last_status = None
 
-client = discord.Client()
-
-broker = Broker(FINANCIALMODELING_KEYS, test_mode=TEST_MODE)
-
-@client.event
 async def on_ready():
     print('We have logged in as {0.user}'.format(client))
+    if 'login' not in startup_times: # on_ready fires again after reconnects
+        startup_phase('login', phase_start)
+        # the avatar is changed along with the channel name, so don't upload it again after a restart
+        global status_pfp
+        stonks_channel = client.get_channel(int(os.getenv('STONKS_CHANNEL')))
+        if stonks_channel is not None and stonks_channel.name in ("stonks", "unstonks"):
+            status_pfp = stonks_channel.name
+        asyncio.ensure_future(prewarm())
+    if price_stream is not None and not price_stream.started():
+        price_stream.start()
+        asyncio.ensure_future(stream_status())
+
+async def prewarm():
+    """Fills the caches the first commands and status tick will need, in the background after login"""
+    start = time.perf_counter()
+    render.warm() # starts the render workers and their kaleido processes
+    holdings = list((await status_account()).view.owned_shares)
+    steps = [('prewarm_prices', broker.get_curr_prices_async(holdings) if holdings else None),
+             ('prewarm_market_open', broker.market_is_open_async())]
+    if status_ticker and status_ticker != "PORTFOLIO":
+        steps.append(('prewarm_status_quote', get_quote(status_ticker)))
+        steps.append(('prewarm_status_history', HISTORY_STORE.get_async(status_ticker)))
+    async def timed(phase, coro):
+        step_start = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            print(f"startup: {phase} failed: {e!r}")
+        startup_phase(phase, step_start)
+    await asyncio.gather(*(timed(phase, coro) for phase, coro in steps if coro is not None))
+    startup_phase('prewarm', start)
 
-@client.event
 async def on_message(message):
     if message.author == client.user:
         return
@@ -47,123 +140,205 @@ async def on_message(message):
             await message.add_reaction("stonks:" + STONKS_EMOJI)
         return
 
+    tokens = [tok for tok in message.content.strip().split(' ')[1:] if tok]
+    command = tokens[0].lower() if tokens and tokens[0].lower() in COMMANDS else "quote"
+    with metrics.timer('command_seconds', command=command):
+        await handle_command(tokens, message)
+        await OUTBOX.flush(message.channel)
+    global first_response_seen
+    if not first_response_seen:
+        first_response_seen = True
+        startup_phase('first_response', STARTED)
+
+async def handle_command(tokens, message):
     async with message.channel.typing():
 
-        tokens = [tok for tok in message.content.strip().split(' ')[1:] if tok]
-
         if len(tokens) == 0:
             await message.add_reaction("stonks:" + STONKS_EMOJI)
             return
 
         if tokens[0].lower() == "status":
-            global status_ticker
+            global status_ticker, status_closed_shown, status_account_key
             status_ticker = tokens[1].upper()
+            if status_ticker == "PORTFOLIO":
+                status_account_key = (await account_of(message)).account
+            status_closed_shown = None
             await ticker_status()
-            await message.channel.send(f"Updated status to track {status_ticker}.")
+            await OUTBOX.send(message.channel, f"Updated status to track {status_ticker}.")
             return
         
         if tokens[0].lower() == "chart":
             if len(tokens) < 2:
-                await message.channel.send("Please provide a ticker to chart.")
+                await OUTBOX.send(message.channel, "Please provide a ticker to chart.")
                 return
             if len(tokens) > 3:
-                await message.channel.send(f"Only charting {tokens[1].upper()}.")
+                await OUTBOX.send(message.channel, f"Only charting {tokens[1].upper()}.")
             if len(tokens) == 2:
                 tokens.append("M")
                 if tokens[1].upper() != "PORTFOLIO":
-                    await message.channel.send("Defaulting to month timescale.")
+                    await OUTBOX.send(message.channel, "Defaulting to month timescale.")
             else:
                 if tokens[2].upper() in "WMYF" and len(tokens[2]) == 1:
                     await chart_message(tokens[1], message, time_span=tokens[2].upper())
                     return
                 else:
-                    await message.channel.send(f"Unrecognized timescale {tokens[2]}. (`W`, `M`, `Y`, `F` supported). Defaulting to `M` (month)")
+                    await OUTBOX.send(message.channel, f"Unrecognized timescale {tokens[2]}. (`W`, `M`, `Y`, `F` supported). Defaulting to `M` (month)")
             await chart_message(tokens[1], message)
             return
 
         if tokens[0].lower() == "info":
-            for token in tokens[1:]:
-                await info_message(token.upper(), message)
+            symbols = unique_symbols(tokens[1:])
+            if "PORTFOLIO" in symbols:
+                symbols.remove("PORTFOLIO")
+                await portfolio_message(message.channel, await account_of(message))
+            if symbols:
+                await info_message(symbols, message)
+            return
+
+        if tokens[0].lower() in ("buy", "sell") and len(tokens) == 5 and tokens[3].lower() in ORDER_TYPES:
+            await resting_order_command(tokens, message)
             return
 
         if tokens[0].lower() == "buy":
             buy_orders = {}
             if len(tokens) % 2 == 0:
-                await message.channel.send("Buy format: `stonks buy ABC 1 DEFG 2 H 3`")
+                await OUTBOX.send(message.channel, "Buy format: `stonks buy ABC 1 DEFG 2 H 3`")
                 return
             for i in range(1, len(tokens) - 1, 2):
                 ticker = tokens[i].upper()
                 try:
                     count = int(tokens[i+1])
                     if count <= 0:
-                        await message.channel.send(f"Shorting is not supported. Skipping order for {count}x{ticker}")
+                        await OUTBOX.send(message.channel, f"Shorting is not supported. Skipping order for {count}x{ticker}")
                         continue
                 except:
-                    await message.channel.send("Buy format: `stonks buy ABC 1 DEFG 2 H 3`")
+                    await OUTBOX.send(message.channel, "Buy format: `stonks buy ABC 1 DEFG 2 H 3`")
                     return
                 buy_orders[ticker] = count
-            msgs = broker.buy_stocks(buy_orders)
-            for msg in msgs:
-                await message.channel.send(msg)
-            await message.channel.send(f"Available cash balance: ${broker.balance:,.2f}")
+            account = await account_of(message)
+            msgs = await account.buy(buy_orders)
+            msgs.append(f"Available cash balance: ${account.view.balance:,.2f}")
+            await send_lines(message.channel, msgs)
             return
 
         if tokens[0].lower() == "sell":
             sell_orders = {}
             if len(tokens) % 2 == 0:
-                await message.channel.send("Sell format: `stonks sell ABC 1 DEFG 2 H 3`")
+                await OUTBOX.send(message.channel, "Sell format: `stonks sell ABC 1 DEFG 2 H 3`")
                 return
             for i in range(1, len(tokens) - 1, 2):
                 ticker = tokens[i].upper()
                 try:
                     count = int(tokens[i+1])
                     if count <= 0:
-                        await message.channel.send(f"Shorting is not supported. Skipping order for {count}x{ticker}")
+                        await OUTBOX.send(message.channel, f"Shorting is not supported. Skipping order for {count}x{ticker}")
                         continue
                 except:
-                    await message.channel.send("Buy format: `stonks sell ABC 1 DEFG 2 H 3`")
+                    await OUTBOX.send(message.channel, "Buy format: `stonks sell ABC 1 DEFG 2 H 3`")
                     return
                 sell_orders[ticker] = count
-            msgs = broker.sell_stocks(sell_orders)
-            for msg in msgs:
-                await message.channel.send(msg)
-            await message.channel.send(f"Available cash balance: ${broker.balance:,.2f}")
-            return
-        
-        if tokens[0].lower() == "info":
-            for token in tokens[1:]:
-                await info_message(token.upper(), message)
+            account = await account_of(message)
+            msgs = await account.sell(sell_orders)
+            msgs.append(f"Available cash balance: ${account.view.balance:,.2f}")
+            await send_lines(message.channel, msgs)
             return
 
         if tokens[0].lower() == "portfolio":
-            await portfolio_message(message)
+            await portfolio_message(message.channel, await account_of(message))
+            return
+
+        if tokens[0].lower() == "market":
+            await market_message(message)
+            return
+
+        if tokens[0].lower() == "leaderboard":
+            await leaderboard_message(message)
             return
 
         if tokens[0].lower() == "help":
             await help_message(message)
             return
 
+        if tokens[0].lower() == "analytics":
+            if len(tokens) < 2 or tokens[1].upper() != "PORTFOLIO":
+                await OUTBOX.send(message.channel, "Analytics format: `stonks analytics portfolio [W|M|Y|F]`")
+                return
+            time_span = tokens[2].upper() if len(tokens) > 2 else "F"
+            if time_span not in ("W", "M", "Y", "F"):
+                await OUTBOX.send(message.channel, f"Unrecognized timescale {tokens[2]}. (`W`, `M`, `Y`, `F` supported)")
+                return
+            await analytics_message(message, time_span)
+            return
+
+        if tokens[0].lower() == "alert":
+            await alert_command(tokens[1:], message)
+            return
+
+        if tokens[0].lower() == "backtest":
+            await backtest_message(tokens[1:], message)
+            return
+
+        if tokens[0].lower() == "stats":
+            await stats_message(message)
+            return
+
         if tokens[0].lower() == "queue":
             if len(tokens) > 1 and tokens[1].lower() == "remove":
                 try:
-                    idx = int(tokens[2])
+                    order_id = int(tokens[2].lstrip('#'))
                 except:
-                    await message.channel.send("Please provide an order number to remove.")
+                    await OUTBOX.send(message.channel, "Please provide an order ID to remove.")
                     return
-                await remove_order(idx, message)
+                await remove_order(order_id, message)
                 return
 
             await queue_message(message)
             return
 
-        for token in tokens:
-            ticker = token.upper()
-            await ticker_message(ticker, message)
-
-def get_quote(symbol):
-    url = 'https://finnhub.io/api/v1/quote?symbol=' + symbol + '&token=' + FINNHUB_KEY
-    response = requests.get(url)
-    quote = response.json()
+        symbols = unique_symbols(tokens)
+        if len(symbols) == 1:
+            await ticker_message(symbols[0], message)
+        else:
+            await quote_table_message(symbols, message)
+
+def unique_symbols(tokens):
+    """Upper cased tokens with duplicates dropped, in order"""
+    return list(dict.fromkeys(token.upper() for token in tokens))
+
+async def gather_limited(func, items, limit=FANOUT_CONCURRENCY):
+    """Runs func(item) for every item concurrently, at most limit at a time.
+    Returns the results in order, with exceptions in place of results for the calls that failed"""
+    semaphore = asyncio.Semaphore(limit)
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+async def send_lines(channel, lines, code_block=False, files=None):
+    """Sends lines as few messages as possible, splitting between lines at Discord's length limit.
+    Files are attached to the first message"""
+    fence = "```" if code_block else ""
+    chunks = []
+    chunk = fence
+    for line in lines:
+        if len(chunk) + len(line) + 1 + len(fence) > DISCORD_MAX_LEN and chunk != fence:
+            chunks.append(chunk + fence)
+            chunk = fence
+        chunk += line + "\n"
+    chunks.append(chunk + fence)
+    for i, chunk in enumerate(chunks):
+        await OUTBOX.send(channel, chunk, files=files if i == 0 and files else None)
+
+async def fetch_quote(symbol):
+    response = await get_scheduler('finnhub').get_async(FINNHUB_URL + 'quote', { 'symbol' : symbol })
+    return response.json()
+
+async def get_quote(symbol):
+    quote = price_book.quote(symbol) if price_stream is not None and price_stream.has(symbol) else None
+    if quote is None:
+        quote = dict(await QUOTE_CACHE.get_async(('finnhub', symbol), lambda: fetch_quote(symbol)))
+        if price_stream is not None and symbol in price_stream.symbols and quote['c'] != 0:
+            price_book.seed(symbol, quote)
     if quote['c'] == 0:
         return None
     change = round(quote['c'] - quote['pc'], 2)
@@ -174,112 +349,472 @@ def get_quote(symbol):
     quote['emoji'] = STONKS_EMOJI if change > 0 else UNSTONKS_EMOJI
     return quote
 
+async def quote_table_message(symbols, message):
+    quotes = await gather_limited(get_quote, symbols)
+    lines = [f"{'':<6}{'Price':>11}{'Change':>11}{'%':>8}{'Open':>11}{'High':>11}{'Low':>11}{'Prev. Close':>13}"]
+    for symbol, quote in zip(symbols, quotes):
+        if isinstance(quote, Exception):
+            lines.append(f"{symbol:<6} error: {quote!r}")
+        elif quote is None:
+            lines.append(f"{symbol:<6} no information found")
+        else:
+            lines.append(f"{symbol:<6}{quote['c']:>11,.2f}{quote['change']:>11}{quote['percent'] + '%':>8}"
+                         f"{quote['o']:>11,.2f}{quote['h']:>11,.2f}{quote['l']:>11,.2f}{quote['pc']:>13,.2f}")
+    print("MESSAGE", f"quote table for {len(symbols)} tickers")
+    await send_lines(message.channel, lines, code_block=True)
+
 async def ticker_message(ticker, message, quote="default"):
     if quote == "default":
-        quote = get_quote(ticker)
+        quote = await get_quote(ticker)
     if quote == None:
         msg = f"No information found for ticker **{ticker}**."
     else:
         msg = "**{symbol}**: ${c:,.2f} ({change} {emoji} {percent}%) *Open*: ${o:,.2f} *High*: ${h:,.2f} *Low*: ${l:,.2f} *Prev. Close*: ${pc:,.2f}".format(**quote)
     print("MESSAGE", msg)
-    await message.channel.send(msg)
+    await OUTBOX.send(message.channel, msg)
 
 @loop(seconds=STATUS_UPDATE_SECS)
 async def ticker_status():
+    with metrics.timer('status_tick_seconds'):
+        async with status_lock:
+            await update_status()
+        await execute_pending_orders(client.get_channel(int(os.getenv('STONKS_CHANNEL'))))
+        if ALERTS.alerts and (TEST_MODE or MARKET_CALENDAR.is_open()):
+            with metrics.timer('alerts_check_seconds'):
+                await check_alerts()
+        await record_daily_closes()
+
+async def stream_status():
+    """Updates the status whenever the streamed prices move (debounced), between the regular ticks.
+    Only the status display, pending orders and alerts are checked on the ticks"""
+    while True:
+        await price_stream.wait_for_change()
+        try:
+            async with status_lock:
+                await update_status()
+        except Exception as e:
+            print(f"stream status update failed: {e!r}")
+
+async def portfolio_prices():
+    """Prices of the status account's holdings, from the streamed book when it has all of them, otherwise from the API"""
+    tickers = list((await status_account()).view.owned_shares)
+    if not tickers:
+        return {}
+    if price_stream is not None and all(price_stream.has(ticker) and price_book.price(ticker) is not None for ticker in tickers):
+        return { ticker : price_book.price(ticker) for ticker in tickers }
+    prices = await broker.get_curr_prices_async(tickers)
+    if price_stream is not None:
+        for ticker, price in prices.items():
+            price_book.seed(ticker, { 'c' : price })
+    return prices
+
+@loop(hours=1)
+async def prefetch_overviews():
+    if not OVERVIEW_PREFETCH or MARKET_CALENDAR.is_open():
+        return
+    symbols = [member['symbol'] for member in await SP500.get_async()]
+    n = await OVERVIEW_CACHE.prefetch(symbols, OVERVIEW_PREFETCH_PER_RUN)
+    if n:
+        print(f"Prefetched {n} company overviews")
+
+@loop(seconds=metrics.METRICS_WRITE_SECS)
+async def write_metrics():
+    metrics.write_prometheus()
+
+async def update_status():
     if not client.is_ready():
         await client.wait_until_ready()
         stonks_channel = client.get_channel(int(os.getenv('STONKS_CHANNEL')))
-        await stonks_channel.send("stonks bot active in " + ("test" if TEST_MODE else "live") + " mode. send `stonks help` for a list of commands")
+        await OUTBOX.send(stonks_channel, "stonks bot active in " + ("test" if TEST_MODE else "live") + " mode. send `stonks help` for a list of commands")
     stonks_channel = client.get_channel(int(os.getenv('STONKS_CHANNEL')))
-    if broker.order_queue and broker.market_is_open():
-        msg = await stonks_channel.send("Executing order queue")
-        broker.execute_queue_orders()
-        await portfolio_message(msg)
+    if price_stream is not None:
+        watched = set((await status_account()).view.owned_shares)
+        if status_ticker != "PORTFOLIO":
+            watched.add(status_ticker)
+        await price_stream.set_symbols(watched)
+
+    # nothing moves while the market is closed, so show the status once after the close and then idle until the open
+    global status_closed_shown
+    if not TEST_MODE and not MARKET_CALENDAR.is_open():
+        closed_since = (status_ticker, MARKET_CALENDAR.last_close())
+        if status_closed_shown == closed_since:
+            return
+        status_closed_shown = closed_since
     
     if status_ticker == "PORTFOLIO":
-        quote = {}
-        quote['c'] = broker.get_curr_val()
-        quote['symbol'] = ""
-        quote['pc'] = broker.get_prev_close()
-
-        percent = round((((quote['c'] / quote['pc']) - 1)*100), 2)
-        quote['percent'] = '+' + str(percent) if percent > 0 else str(percent)
+        quote = None
+        account = await status_account()
+        value = await account.valuation(await portfolio_prices())
+        if value is not None: # None while a holding has no price
+            quote = {}
+            quote['c'] = value
+            quote['symbol'] = ""
+            quote['pc'] = account.view.get_prev_close()
+
+            percent = round((((quote['c'] / quote['pc']) - 1)*100), 2)
+            quote['percent'] = '+' + str(percent) if percent > 0 else str(percent)
 
     else:
-        quote = get_quote(status_ticker)
+        quote = await get_quote(status_ticker)
 
     if quote == None:
         stat = f"ERROR: {status_ticker}"
     else:
         stat = "{symbol} ${c:,.2f} {percent}%".format(**quote)
     print("STATUS", stat)
-    game = discord.Activity(name=stat, type=discord.ActivityType.watching)
-    await client.change_presence(status=discord.Status.online, activity=game)
-    new_name = "stonks" if quote['c'] > quote['pc'] else "unstonks"
-    if new_name != stonks_channel.name:
+    global last_status
+    if stat != last_status:
+        game = discord.Activity(name=stat, type=discord.ActivityType.watching)
+        await client.change_presence(status=discord.Status.online, activity=game)
+        last_status = stat
+    if quote is None:
+        return
+    # hysteresis, so a price hovering around the previous close doesn't flip the name back and forth
+    if quote['c'] > quote['pc'] * (1 + STATUS_HYSTERESIS_PCT / 100):
+        new_name = "stonks"
+    elif quote['c'] < quote['pc'] * (1 - STATUS_HYSTERESIS_PCT / 100):
+        new_name = "unstonks"
+    else:
+        return
+    if await OUTBOX.rename_channel(stonks_channel, new_name):
         print("Updating channel name to: " + new_name)
-        await stonks_channel.edit(name=new_name)
-        new_pfp = pfp_kalm if quote['c'] > quote['pc'] else pfp_panik
-        await client.user.edit(avatar=new_pfp)
+    global status_pfp
+    if new_name != status_pfp and await OUTBOX.change_avatar(client.user, bytearray(avatar("kalm" if new_name == "stonks" else "panik"))):
+        status_pfp = new_name
         print("Changing picture")
 
+async def execute_pending_orders(channel):
+    """Executes the order queues and crossed limit/stop orders of every account with open orders,
+    after one batched price fetch for all of them (the accounts' own fetches then hit the quote cache)"""
+    pending = accounts.pending()
+    if shared_account.view.pending_tickers():
+        pending.append((None, None, shared_account.view.pending_tickers()))
+    if not pending or not await broker.market_is_open_async():
+        return
+    await broker.get_curr_prices_async(list(dict.fromkeys(ticker for key, user_id, tickers in pending for ticker in tickers)))
+    for key, user_id, tickers in pending:
+        account = shared_account if key is None else await accounts.by_key(key)
+        report = []
+        executed = await account.execute_queue()
+        if executed:
+            report += ["Executing order queue"] + executed
+        filled = await account.match_orders()
+        if filled:
+            report += ["Filling limit/stop orders"] + filled
+        if report:
+            if user_id:
+                report.insert(0, f"<@{user_id}>")
+            await portfolio_message(channel, account, report)
+
+async def record_daily_closes():
+    """Once after each close, records the value of every account holding shares in its portfolio history,
+    with one batched price fetch for all of them, so accounts nobody looked at that day still get a daily bar"""
+    global daily_closes_recorded
+    if TEST_MODE or MARKET_CALENDAR.is_open():
+        return
+    now = time.time()
+    last_close = MARKET_CALENDAR.last_close(now)
+    # the bar goes on today's date, so a close from an earlier day (e.g. starting up over the weekend) is skipped
+    if daily_closes_recorded == last_close or MARKET_CALENDAR.eastern_date(last_close) != MARKET_CALENDAR.eastern_date(now):
+        return
+    holders = accounts.holders()
+    tickers = list(dict.fromkeys([ticker for key, holdings in holders for ticker in holdings] + list(shared_account.view.owned_shares)))
+    prices = await broker.get_curr_prices_async(tickers) if tickers else {}
+    recorded = 0
+    with metrics.timer('daily_close_seconds'):
+        for account in [shared_account] + [await accounts.by_key(key) for key, holdings in holders]:
+            if await account.valuation(prices) is not None: # accounts holding an unpriced ticker get no bar today
+                recorded += 1
+    daily_closes_recorded = last_close
+    metrics.count('daily_closes_recorded', recorded)
+
+async def check_alerts():
+    """Fires the alerts crossed by the current prices, one batched price fetch for all alerted symbols"""
+    prices = await broker.get_curr_prices_async(ALERTS.symbols())
+    by_channel = {}
+    for alert, price in ALERTS.check(prices):
+        mention = f"<@{alert.user_id}> " if alert.user_id else ""
+        by_channel.setdefault(alert.channel_id, []).append(f"{mention}Alert {alert.describe()} fired at ${price:,.2f}")
+    for channel_id, lines in by_channel.items():
+        channel = client.get_channel(channel_id)
+        if channel is not None:
+            await send_lines(channel, lines)
+
+ORDER_USAGE = "Order format: `stonks buy ABC 10 limit 180.50`, `stonks sell ABC 10 stop 90` (limit or stop, then the trigger price)"
+
+async def resting_order_command(tokens, message):
+    """stonks buy|sell TICKER QTY limit|stop PRICE"""
+    try:
+        shares = int(tokens[2])
+        trigger = float(tokens[4].lstrip('$'))
+    except ValueError:
+        await OUTBOX.send(message.channel, ORDER_USAGE)
+        return
+    if shares <= 0 or trigger <= 0:
+        await OUTBOX.send(message.channel, ORDER_USAGE)
+        return
+    msgs = await (await account_of(message)).place_order(tokens[0].upper(), tokens[3].lower(), tokens[1].upper(), shares, trigger)
+    msgs.append("`stonks queue` to see open orders, `stonks queue remove ID` to cancel.")
+    await send_lines(message.channel, msgs)
+
+ALERT_USAGE = "Alert format: `stonks alert ABC above 200`, `stonks alert ABC below 150`, `stonks alert ABC pct-move 5`, `stonks alert list`, `stonks alert remove ID`"
+
+async def alert_command(args, message):
+    if args and args[0].lower() == "list":
+        alerts = sorted(ALERTS.for_channel(message.channel.id), key=lambda alert: alert.id)
+        await send_lines(message.channel, ["Alerts in this channel:"] + [alert.describe() for alert in alerts] if alerts else ["No alerts set in this channel."])
+        return
+    if args and args[0].lower() == "remove":
+        try:
+            alert_id = int(args[1].lstrip('#'))
+        except (IndexError, ValueError):
+            await OUTBOX.send(message.channel, "Please provide an alert number to remove.")
+            return
+        alert = ALERTS.alerts.get(alert_id)
+        if alert is None or alert.channel_id != message.channel.id:
+            await OUTBOX.send(message.channel, f"No alert #{alert_id} in this channel.")
+            return
+        ALERTS.remove(alert_id)
+        await OUTBOX.send(message.channel, f"Removed alert {alert.describe()}.")
+        return
+    try:
+        symbol, kind, value = args[0].upper(), args[1].lower(), float(args[2].lstrip('$').rstrip('%'))
+    except (IndexError, ValueError):
+        await OUTBOX.send(message.channel, ALERT_USAGE)
+        return
+    if kind not in ALERT_KINDS or value <= 0:
+        await OUTBOX.send(message.channel, ALERT_USAGE)
+        return
+    prices, missing = await broker.get_curr_prices_and_missing_async([symbol])
+    if missing:
+        await OUTBOX.send(message.channel, f"No price found for {symbol}.")
+        return
+    alert = ALERTS.add(symbol, kind, value, prices[symbol], message.channel.id, message.author.id)
+    await OUTBOX.send(message.channel, f"Set alert {alert.describe()} (now ${prices[symbol]:,.2f}). `stonks alert list` to see all alerts.")
+
 async def chart_message(ticker, message, time_span="M"):
-    quote = get_quote(ticker.upper())
+    quote = await get_quote(ticker.upper())
 
     if ticker.upper() == "PORTFOLIO":
-        broker.save_chart_of_portfolio_history()
-    elif not save_chart(ticker, realtime=quote, time_span=time_span):
-        await(message.channel.send(ticker.upper() + " not found."))
+        account = await account_of(message)
+        image = await account.view.render_chart_of_portfolio_history_async(time_span)
+    else:
+        image = await render_chart_async(ticker, realtime=quote, time_span=time_span)
+    if image is None:
+        await OUTBOX.send(message.channel, ticker.upper() + " not found.")
         return
     print("CHART", ticker)
-    await message.channel.send(file=discord.File('stonks.jpg'))
+    await OUTBOX.send(message.channel, file=discord.File(io.BytesIO(image), filename='stonks.jpg'))
     if ticker.upper() == "PORTFOLIO":
-        await message.channel.send(f"Portfolio value: ${broker.get_curr_val():,.2f} (`stonks portfolio` for full holdings)")
+        value = await account.valuation()
+        value_str = "unavailable, a holding has no price" if value is None else f"${value:,.2f}"
+        await OUTBOX.send(message.channel, f"Portfolio value: {value_str} (`stonks portfolio` for full holdings)")
     else:
         await ticker_message(ticker.upper(), message, quote=quote)
 
-async def info_message(symbol, message):
-    if symbol == "PORTFOLIO":
-        await portfolio_message(message)
-        return
-
-    url = 'https://www.alphavantage.co/query?function=OVERVIEW&symbol=' + symbol + '&apikey=' + ALPHAVANTAGE_KEY
-    response = requests.get(url)
-    info = response.json()
-    desc = info['Description']
-    desc_lines = textwrap.wrap(desc, width=INFO_WIDTH)
-    with open('stonks.txt', mode="w") as f:
-        f.write('\n'.join(desc_lines))
-    period = desc.find(".", 50) # skip period from Corp. etc
-    first_sentence = desc[:period+1]
-    msg = "Info for **" + symbol + "**: " + first_sentence + " [Open attached file for full info]"
-    await message.channel.send(msg, file=discord.File('stonks.txt'))
-
-async def portfolio_message(message):
-    msg = "Current portfolio: \n```"
-    total = broker.balance
-    if broker.owned_shares:
-        prices = broker.get_curr_prices(broker.owned_shares)
-        for ticker in broker.owned_shares:
-            n_shares = broker.owned_shares[ticker]
-            cost = broker.cost_basis[ticker]
+async def info_message(symbols, message):
+    infos = await gather_limited(OVERVIEW_CACHE.get_async, symbols)
+    lines = []
+    files = []
+    for symbol, info in zip(symbols, infos):
+        if isinstance(info, Exception):
+            lines.append(f"Info for **{symbol}**: error: {info!r}")
+            continue
+        desc = info.get('Description')
+        if not desc:
+            lines.append(f"No information found for ticker **{symbol}**.")
+            continue
+        period = desc.find(".", 50) # skip period from Corp. etc
+        first_sentence = desc[:period+1]
+        lines.append("Info for **" + symbol + "**: " + first_sentence + " [Open attached file for full info]")
+        text = '\n'.join(textwrap.wrap(desc, width=INFO_WIDTH))
+        files.append(discord.File(io.BytesIO(text.encode()), filename=f'{symbol}.txt'))
+    # Discord allows 10 attachments per message
+    for i in range(0, max(len(files), 1), 10):
+        await send_lines(message.channel, lines if i == 0 else [f"More info files ({i + 1}-{min(i + 10, len(files))})"], files=files[i:i + 10])
+
+async def portfolio_message(channel, account, report=None):
+    view = account.view
+    msg = ""
+    if report:
+        msg += "\n".join(report) + "\n"
+    msg += "Current portfolio: \n```"
+    total = view.balance
+    if view.owned_shares:
+        prices = await broker.get_curr_prices_async(view.owned_shares)
+        for ticker in view.owned_shares:
+            n_shares = view.owned_shares[ticker]
+            cost = view.cost_basis[ticker]
             cost_str = f"{cost:.2f}"
             msg += f"{ticker.ljust(5)}{str(n_shares).rjust(6)} @ ${cost_str.ljust(9)}"
             price = prices[ticker]
             price_str = f"{price:,.2f}"
             msg += f" Current: ${price_str.ljust(8)} (total: "
-            subtotal = prices[ticker] * broker.owned_shares[ticker]
+            subtotal = prices[ticker] * view.owned_shares[ticker]
             subtotal_str = f"{subtotal:,.2f}"
             percent = ((price - cost)/cost) * 100
             percent_str = f"+{percent:.2f}" if percent > 0 else f"{percent:.2f}"
             msg += f"${subtotal_str.ljust(10)} | {percent_str}%)\n"
             total += subtotal
-    msg += f"\nCash Balance:          ${broker.balance:,.2f}\n"
+    msg += f"\nCash Balance:          ${view.balance:,.2f}\n"
     msg += f"Total portfolio value: ${total:,.2f}\n"
     msg += "```"
-    await message.channel.send(msg)
+    await OUTBOX.send(channel, msg)
 
 
+async def market_message(message):
+    from market import MARKET # only needed for this command, kept off the startup path
+    stats, image = await MARKET.get_async()
+    if stats is None:
+        await OUTBOX.send(message.channel, "Couldn't load S&P 500 quotes, try again later.")
+        return
+    lines = [f"S&P 500: {format_pct(stats['cap_weighted_change'])} cap weighted, {format_pct(stats['equal_weighted_change'])} equal weighted, "
+             f"median {format_pct(stats['median_change'])} ({stats['quoted']} of {stats['constituents']} quoted)",
+             f"Advancers / decliners / unchanged: {stats['advancers']} / {stats['decliners']} / {stats['unchanged']}",
+             "",
+             f"{'Sector':<24}{'Change':>9}{'Up':>9}"]
+    for sector, change, count, up in stats['sectors']:
+        lines.append(f"{sector[:23]:<24}{format_pct(change):>9}{f'{up}/{count}':>9}")
+    lines.append("")
+    lines.append(f"{'Top gainers':<22}Top losers")
+    for (gainer, gainer_price, gainer_change), (loser, loser_price, loser_change) in zip(stats['gainers'], stats['losers']):
+        lines.append(f"{gainer:<6}{format_pct(gainer_change):>9}{'':<7}{loser:<6}{format_pct(loser_change):>9}")
+    await send_lines(message.channel, lines, code_block=True, files=[discord.File(io.BytesIO(image), filename='market.jpg')])
+
+async def leaderboard_message(message):
+    """Ranks every account by total value, with one batched price fetch for the union of their holdings"""
+    summaries = accounts.summaries(message.guild.id if message.guild else None)
+    if not summaries:
+        await OUTBOX.send(message.channel, "No accounts yet, `stonks buy` to open one.")
+        return
+    tickers = list(dict.fromkeys(ticker for user_id, balance, holdings in summaries for ticker in holdings))
+    prices = await broker.get_curr_prices_async(tickers) if tickers else {}
+    ranking = accounts.leaderboard(summaries, prices)
+    lines = [f"Leaderboard ({len(ranking)} accounts):"]
+    for rank, (user_id, value, balance) in enumerate(ranking, 1):
+        if rank > LEADERBOARD_SIZE and user_id != message.author.id:
+            continue
+        if rank > LEADERBOARD_SIZE + 1:
+            lines.append("...")
+        user = client.get_user(user_id)
+        name = user.name if user is not None else str(user_id)
+        lines.append(f"{rank:>3}. {name[:20]:<20} ${value:>16,.2f} {format_pct(value / STARTING_BALANCE - 1):>9}")
+    await send_lines(message.channel, lines, code_block=True)
+
+def format_pct(value):
+    return "n/a" if value is None else f"{value * 100:+.2f}%"
+
+def format_ratio(value):
+    return "n/a" if value is None else f"{value:.2f}"
+
+async def analytics_message(message, time_span):
+    import analytics # only needed for this command, kept off the startup path
+    account = await account_of(message)
+    view = account.view
+    prices = await broker.get_curr_prices_async(view.owned_shares) if view.owned_shares else {}
+    # valued without recording, a new bar would change the history version and miss the memo every time
+    total = view.balance + sum(shares * prices[ticker] for ticker, shares in view.owned_shares.items() if ticker in prices)
+    stats = analytics.history_stats(view.portfolio_history, time_span, account=view.account)
+    lines = [f"Portfolio analytics ({time_span}):"]
+    if stats is None:
+        lines.append("Not enough history yet, need at least two days.")
+    else:
+        lines.append(f"From {datetime.fromordinal(stats['start_date']).date()} over {stats['days']} trading days")
+        lines.append(f"Cumulative return:   {format_pct(stats['cumulative_return'])}")
+        lines.append(f"Mean daily return:   {format_pct(stats['mean_daily_return'])}")
+        lines.append(f"Best / worst day:    {format_pct(stats['best_day'])} / {format_pct(stats['worst_day'])}")
+        lines.append(f"Volatility (annual): {stats['volatility'] * 100:.2f}%")
+        lines.append(f"Max drawdown:        {format_pct(stats['max_drawdown'])} "
+                     f"({datetime.fromordinal(stats['peak_date']).date()} to {datetime.fromordinal(stats['trough_date']).date()})")
+        lines.append(f"Sharpe / Sortino:    {format_ratio(stats['sharpe'])} / {format_ratio(stats['sortino'])}")
+    if view.owned_shares:
+        lines.append("")
+        lines.append(f"{'':<6}{'Value':>14}{'Weight':>9}{'Unreal. P/L':>14}{'Contrib.':>10}")
+        for ticker, value, weight, pnl, contribution in analytics.contributions(view.owned_shares, view.cost_basis, prices, total):
+            lines.append(f"{ticker:<6}{value:>14,.2f}{weight * 100:>8.2f}%{pnl:>14,.2f}{format_pct(contribution):>10}")
+    await send_lines(message.channel, lines, code_block=True)
+
+BACKTEST_USAGE = ("Backtest format: `stonks backtest YYYY-MM-DD ABC 1 DEFG 2 YYYY-MM-DD ABC -1` (orders on each date, "
+                  "negative quantities sell) or `stonks backtest strategy hold,sma:20:50,momentum:60 ABC DEFG` (`strategy all` runs the defaults)")
+
+def parse_backtest_orders(args):
+    """(date, ticker, shares) orders from DATE TICKER QTY [TICKER QTY...] [DATE ...] tokens, each date applying to
+    the pairs after it. Negative quantities are sells. None if the tokens aren't in that format"""
+    orders = []
+    day = None
+    i = 0
+    while i < len(args):
+        try:
+            day = date.fromisoformat(args[i])
+            i += 1
+            continue
+        except ValueError:
+            pass
+        if day is None or i + 1 >= len(args):
+            return None
+        try:
+            shares = int(args[i + 1])
+        except ValueError:
+            return None
+        if shares == 0:
+            return None
+        orders.append((day, args[i].upper(), shares))
+        i += 2
+    return orders or None
+
+async def load_bars(tickers):
+    """ticker -> stored daily bars, fetching any that are missing or out of date. Unknown tickers are left out"""
+    results = await gather_limited(HISTORY_STORE.get_async, tickers)
+    return { ticker : bars for ticker, bars in zip(tickers, results) if not isinstance(bars, Exception) and bars is not None and len(bars) }
+
+async def backtest_message(args, message):
+    import backtest # only needed for this command, kept off the startup path
+    if len(args) < 2:
+        await OUTBOX.send(message.channel, BACKTEST_USAGE)
+        return
+    lines = []
+    if args[0].lower() == "strategy":
+        specs = list(backtest.DEFAULT_STRATEGIES) if args[1].lower() == "all" else args[1].lower().split(',')
+        try:
+            for spec in specs:
+                backtest.parse_strategy(spec)
+        except ValueError as e:
+            await OUTBOX.send(message.channel, f"{e}. {BACKTEST_USAGE}")
+            return
+        tickers = unique_symbols(args[2:])
+        bars = await load_bars(tickers)
+        lines += [f"No price history found for {ticker}, skipping." for ticker in tickers if ticker not in bars]
+        if not bars:
+            await send_lines(message.channel, lines)
+            return
+        results = await backtest.run_strategies_async(specs, bars)
+        lines.append(f"Backtest of {', '.join(bars)} from {date.fromordinal(int(results[0]['dates'][0]))}, ${backtest.BACKTEST_CASH:,.0f} split evenly:")
+    else:
+        orders = parse_backtest_orders(args)
+        if orders is None:
+            await OUTBOX.send(message.channel, BACKTEST_USAGE)
+            return
+        start = min(day for day, _, _ in orders)
+        bars = await load_bars(unique_symbols(ticker for _, ticker, _ in orders))
+        if not bars:
+            await OUTBOX.send(message.channel, "No price history found for those tickers.")
+            return
+        dates, closes = backtest.align(bars)
+        equity, lines = backtest.replay_orders(orders, dates, closes, list(bars))
+        first = int(dates.searchsorted(start.toordinal()))
+        results = [backtest.summarize(f"orders from {start}", dates[first:], equity[first:])] if first < len(dates) - 1 else []
+
+    if results:
+        lines.append(f"{'':<22}{'Final':>15}{'Return':>10}{'Vol.':>9}{'Max DD':>9}{'Sharpe':>8}")
+        for result in results:
+            stats = result['stats']
+            lines.append(f"{result['name']:<22}{result['final']:>15,.2f}{format_pct(stats['cumulative_return']):>10}"
+                         f"{stats['volatility'] * 100:>8.2f}%{format_pct(stats['max_drawdown']):>9}{format_ratio(stats['sharpe']):>8}")
+        best = max(results, key=lambda result: result['final'])
+        image = await render.render_candlestick_async(*backtest.chart_args(best))
+        await OUTBOX.send(message.channel, file=discord.File(io.BytesIO(image), filename='backtest.jpg'))
+    await send_lines(message.channel, lines, code_block=bool(results))
+
 async def help_message(message):
     msg =  "Usage for stonks-bot:\n```"
     msg += "stonks help                     : display this message\n"
@@ -288,42 +823,84 @@ async def help_message(message):
     msg += "stonks info TICKER1 TICKER2...  : get company info for specified tickers\n"
     msg += "stonks status TICKER            : watch company (or PORTFOLIO) in bot status\n"
     msg += "stonks chart TICKER TIMESCALE   : draw chart for specified ticker\n"
-    msg += "    +---- available timescales  : W (week), M (month), Y (year), F (full)\n\n"
-    msg += "\n### Paper Trading ###\n"
+    msg += "    +---- available timescales  : W (week), M (month), Y (year), F (full)\n"
+    msg += "stonks market                   : S&P 500 sector heatmap, top movers and breadth\n"
+    msg += "stonks alert TICKER above|below PRICE, stonks alert TICKER pct-move PERCENT\n"
+    msg += "    +---- get pinged when the price crosses it (alert list, alert remove ID)\n\n"
+    msg += "\n### Paper Trading (everyone has their own account) ###\n"
     msg += "stonks buy TICKER1 QTY1 TICKER2 QTY2...\n"
     msg += "    +---- buy shares (or add to order queue to execute at market open)\n\n"
     msg += "stonks sell TICKER1 QTY1 TICKER2 QTY2...\n"
     msg += "    +---- sell shares (or add to order queue to execute at market open)\n\n"
-    msg += "stonks queue                    : show the current order queue\n"
-    msg += "stonks queue remove i           : remove the i'th order from the queue\n"
-    msg += "stonks portfolio                : get current holdings information\n"
+    msg += "stonks buy|sell TICKER QTY limit|stop PRICE\n"
+    msg += "    +---- fill once the price crosses PRICE (limit: at or better, stop: at or worse)\n\n"
+    msg += "stonks queue                    : show the order queue and open limit/stop orders\n"
+    msg += "stonks queue remove ID          : cancel order #ID\n"
+    msg += "stonks portfolio                : get your current holdings information\n"
     msg += "stonks info portfolio           : also get current holdings information\n"
     msg += "stonks chart portfolio          : draw chart of holdings value over time\n"
+    msg += "stonks analytics portfolio TIMESCALE\n"
+    msg += "    +---- returns, volatility, drawdown, Sharpe/Sortino and per-holding contribution\n"
+    msg += "stonks backtest DATE TICKER1 QTY1 TICKER2 QTY2 DATE2 TICKER1 -QTY...\n"
+    msg += "    +---- what if you had traded on those dates (YYYY-MM-DD, negative QTY sells) until today\n"
+    msg += "stonks backtest strategy SPEC1,SPEC2 TICKER1 TICKER2...\n"
+    msg += "    +---- compare hold, sma:FAST:SLOW, momentum:DAYS (or all) on daily history\n"
+    msg += "stonks leaderboard              : rank everyone's accounts by total value\n"
+    msg += "\n### Bot ###\n"
+    msg += "stonks stats                    : show latency and upstream call statistics\n"
     msg += "```"
 
-    await message.channel.send(msg)
+    await OUTBOX.send(message.channel, msg)
+
+async def stats_message(message):
+    if not metrics.STATS_ENABLED:
+        await OUTBOX.send(message.channel, "Stats are disabled (`STATS_ENABLED=False`).")
+        return
+    lines = metrics.summary()
+    lines.append(f"quote cache: {QUOTE_CACHE.stats()}")
+    lines.append(f"chart cache: {CHART_CACHE.stats()}")
+    lines.append(f"overview cache: {OVERVIEW_CACHE.stats()}")
+    lines.append(f"accounts: {accounts.stats()}")
+    await send_lines(message.channel, lines, code_block=True)
 
 async def queue_message(message):
-    if broker.order_queue:   
-        msg = "Order queue: ```\n"
-        for i, order in enumerate(broker.order_queue):
-            msg += f"{i} ({order[0]}): "
-            for ticker in order[1]:
-                msg += f"{ticker} x{order[1][ticker]}   "
-            msg += "\n"
-        msg += "```Use `stonks queue remove i` to remove the `i`th order."
-    else:
-        msg += "Order queue is empty."
-    await message.channel.send(msg)
-
-async def remove_order(idx, message):
-    order = broker.remove_order(idx)
-    msg =  f"Removed order from the queue:\n"
-    msg += f"`{idx} ({order[0]}): "
-    for ticker in order[1]:
-        msg += f"{ticker} x{order[1][ticker]}   "
-    msg += '`\n `stonks queue` to see the updated queue.'
-    await message.channel.send(msg)
-
-ticker_status.start()
-client.run(TOKEN)
\ No newline at end of file
+    view = (await account_of(message)).view
+    if not view.order_queue and not view.resting_orders:
+        await OUTBOX.send(message.channel, "Order queue is empty.")
+        return
+    lines = []
+    if view.order_queue:
+        lines.append("Order queue (fills at market open):")
+        lines += [describe_queued(entry) for entry in view.order_queue]
+    if view.resting_orders:
+        lines.append("Limit/stop orders:")
+        lines += [order.describe() for order in view.resting_orders]
+    await send_lines(message.channel, lines, code_block=True)
+    await OUTBOX.send(message.channel, "Use `stonks queue remove ID` to cancel order `#ID`.")
+
+async def remove_order(order_id, message):
+    description = await (await account_of(message)).cancel_order(order_id)
+    if description is None:
+        await OUTBOX.send(message.channel, f"No order #{order_id}. `stonks queue` to see open orders.")
+        return
+    await OUTBOX.send(message.channel, f"Cancelled order `{description}`\n`stonks queue` to see the updated queue.")
+
+def setup():
+    """Builds the Discord client, the accounts and the SQLite backed caches, and loads the shared account"""
+    global client, broker, shared_account, accounts, OVERVIEW_CACHE, ALERTS, ALERT_KINDS, phase_start
+    from overview_cache import OVERVIEW_CACHE
+    from alerts import ALERTS, ALERT_KINDS
+    client = discord.Client()
+    client.event(on_ready)
+    client.event(on_message)
+    broker = Broker(FINANCIALMODELING_KEYS, test_mode=TEST_MODE)
+    shared_account = BrokerActor(broker)
+    accounts = AccountStore(FINANCIALMODELING_KEYS, test_mode=TEST_MODE)
+    phase_start = startup_phase('broker_load', phase_start)
+
+if __name__ == '__main__':
+    setup()
+    ticker_status.start()
+    write_metrics.start()
+    prefetch_overviews.start()
+    client.run(TOKEN)
@@ -0,0 +1,39 @@
+from bisect import bisect_left, bisect_right, insort
+
+
+class ThresholdIndex():
+    """Per symbol sorted price thresholds. Entries are fired when the price is at or above their 'above'
+    threshold or at or below their 'below' one, found by bisection in O(log n + k)"""
+
+    def __init__(self):
+        self._above = {} # symbol -> sorted [(threshold, id)]
+        self._below = {} # symbol -> sorted [(threshold, id)]
+
+    def add(self, symbol, item_id, above=None, below=None):
+        if above is not None:
+            insort(self._above.setdefault(symbol, []), (above, item_id))
+        if below is not None:
+            insort(self._below.setdefault(symbol, []), (below, item_id))
+
+    def remove(self, symbol, item_id, above=None, below=None):
+        """Removes an entry, given the same thresholds it was added with"""
+        for index, threshold in ((self._above, above), (self._below, below)):
+            if threshold is None or symbol not in index:
+                continue
+            entries = index[symbol]
+            idx = bisect_left(entries, (threshold, item_id))
+            if idx < len(entries) and entries[idx] == (threshold, item_id):
+                del entries[idx]
+            if not entries:
+                del index[symbol]
+
+    def symbols(self):
+        return list(self._above.keys() | self._below.keys())
+
+    def crossed(self, symbol, price):
+        """Ids of the entries on symbol that price crosses, without duplicates"""
+        above = self._above.get(symbol, [])
+        below = self._below.get(symbol, [])
+        fired = [item_id for _, item_id in above[:bisect_right(above, (price, float('inf')))]]
+        fired += [item_id for _, item_id in below[bisect_left(below, (price, float('-inf'))):]]
+        return list(dict.fromkeys(fired))